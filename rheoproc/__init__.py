@@ -47,10 +47,11 @@ import rheoproc.query as query
 import rheoproc.nansafemath as nansafemath
 import rheoproc.util as util
 import rheoproc.fft as fft
+import rheoproc.pool as pool
 
 from rheoproc.plot import plot_init, get_plot_name, MultiPagePlot, pyplot
 from rheoproc.data import get_data
-from rheoproc.query import get_log, get_logs, get_group, query_db
+from rheoproc.query import get_log, get_logs, get_group, get_groups, query_db, iter_query
 from rheoproc.error import timestamp, warning
 from rheoproc.version import version
 
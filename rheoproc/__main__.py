@@ -1,5 +1,40 @@
+import sys
+import json
+
+from rheoproc.cache import Cache
 from rheoproc.server import Server
+from rheoproc.summary import backfill_summaries
+from rheoproc.warm import warm_cache
+
+
+def get_arg(name, default=None):
+    if name in sys.argv:
+        return sys.argv[sys.argv.index(name)+1]
+    return default
+
 
 if __name__ == '__main__':
-    s = Server()
-    s.run()
\ No newline at end of file
+    if sys.argv[1:2] == ['backfill']:
+        # python -m rheoproc backfill [--database <PATH>] [--max-proc <N>]
+        backfill_summaries(database=get_arg('--database', '../data/.database.db'),
+                           max_processes=int(get_arg('--max-proc', 20)))
+    elif sys.argv[1:2] == ['stats']:
+        # python -m rheoproc stats
+        Cache().print_stats()
+    elif sys.argv[1:2] == ['warm']:
+        # python -m rheoproc warm [--database <PATH>] [--query <SQL>] [--config <JSON KWARGS>] [--max-proc <N>]
+        #                         [--nice <N>] [--interval <SECONDS>]
+        interval = get_arg('--interval')
+        warm_cache(database=get_arg('--database', '../data/.database.db'),
+                   query=get_arg('--query', 'SELECT * FROM LOGS;'),
+                   max_processes=int(get_arg('--max-proc', 4)),
+                   nice=int(get_arg('--nice', 19)),
+                   interval=float(interval) if interval else None,
+                   **json.loads(get_arg('--config', '{}')))
+    elif sys.argv[1:2] == ['clean']:
+        # python -m rheoproc clean
+        Cache().clean()
+    else:
+        # python -m rheoproc [--max-jobs <N>] [--max-proc <N>]
+        s = Server(max_jobs=int(get_arg('--max-jobs', 2)), max_processes=int(get_arg('--max-proc', 20)))
+        s.run()
@@ -8,14 +8,53 @@ import hashlib
 import json
 import sys
 import time
-from functools import lru_cache
+import sqlite3
+import threading
+import inspect
+import functools
+from collections import OrderedDict
+from contextlib import contextmanager
+from enum import Enum
+
+try:
+    import fcntl
+except ImportError:
+    # no advisory locking (e.g. on Windows)
+    fcntl = None
+
+import numpy as np
 
 from rheoproc.error import timestamp, warning
 from rheoproc.exception import ScriptCacheError
 from rheoproc.util import run_other_script
+from rheoproc.sql import get_current_row_hash
+from rheoproc import colcache
+from rheoproc.lazylog import LazyLog
 
 
 CACHE_DIR = os.path.expanduser("~/.cache/rheoproc")
+# size budget of the cache in bytes: least recently used objects are removed to stay within it. Unlimited if unset.
+MAX_CACHE_BYTES = int(os.environ.get('RHEOPROC_CACHE_MAX_BYTES', 0)) or None
+STATS = ['hits', 'misses', 'evictions', 'reclaimed_bytes']
+# objects are validated when loaded; if set, the whole cache is also checked over in the background
+SWEEP_CACHE = bool(os.environ.get('RHEOPROC_CACHE_SWEEP'))
+# format processed logs are cached in: 'pickle', or 'columns' for memory-mapped arrays (see rheoproc.colcache)
+LOG_CACHE_FORMAT = os.environ.get('RHEOPROC_LOG_CACHE_FORMAT', 'pickle')
+CACHE_FORMATS = {'pickle': 'pickle', 'columns': 'cols'}
+# objects are written to temporary files then renamed into place; any older than this were abandoned by a crash
+STALE_TEMP_SECONDS = 60*60
+# size budget in bytes of the in-memory tier above the disk cache (see MemoryTier). Disabled if unset.
+MAX_MEMORY_BYTES = int(os.environ.get('RHEOPROC_CACHE_MEMORY_BYTES', 0)) or None
+# default stamp of CacheSingleton.remove: remove the object whatever its stamp
+ANY_STAMP = object()
+
+
+def fmt_bytes(n):
+    for unit in ['b', 'kb', 'Mb', 'Gb']:
+        if n < 1024:
+            break
+        n /= 1024
+    return f'{n:.1f} {unit}'
 
 
 class CachedObjectData:
@@ -28,7 +67,7 @@ class CachedObjectData:
     def is_invalid(self):
         if self.expires is not None:
             pass
-        if not os.path.isfile(self.path):
+        if not os.path.exists(self.path):
             return 'Could not find cached blob.'
 
         now = time.time()
@@ -38,6 +77,16 @@ class CachedObjectData:
         if self.depends_on is not None:
             pickle_mtime = os.path.getmtime(self.path)
             for dep in self.depends_on:
+                if isinstance(dep, dict):
+                    # dependency on the result of a query (see rheoproc.sql.get_row_dependency)
+                    if not os.path.isfile(dep['database']):
+                        return f'Database {dep["database"]} not found.'
+                    if get_current_row_hash(dep['query'], dep['database']) != dep['hash']:
+                        return f'Database rows changed since cached ({dep["query"]}).'
+                    continue
+
+                if not os.path.exists(dep):
+                    return f'Dependency {dep} not found.'
                 dep_mtime = os.path.getmtime(dep)
 
                 if dep_mtime > pickle_mtime:
@@ -55,49 +104,196 @@ class CachedObjectData:
 
 
 class CacheIndex:
+    '''
+    Index of cached objects, kept in an SQLite database (in WAL mode, so that readers don't block the writer) with one
+    row per object. It may be used from several threads and processes at once: each gets its own connection.
+    '''
 
     def __init__(self, path=None):
         if path is None:
-            path = f'{CACHE_DIR}/index.json'
+            path = f'{CACHE_DIR}/index.db'
         self.path = path
+        self.local = threading.local()
+        self.inherited = list()
+        conn = self.connection()
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS OBJECTS (KEY TEXT PRIMARY KEY, PATH TEXT NOT NULL, EXPIRES REAL, '
+                         'DEPENDS_ON TEXT, SIZE INTEGER, LAST_ACCESS REAL);')
+            columns = [row[1] for row in conn.execute('PRAGMA table_info(OBJECTS);')]
+            for column, column_type in [('SIZE', 'INTEGER'), ('LAST_ACCESS', 'REAL')]:
+                if column not in columns:
+                    conn.execute(f'ALTER TABLE OBJECTS ADD COLUMN {column} {column_type};')
+            conn.execute('CREATE INDEX IF NOT EXISTS OBJECTS_BY_ACCESS ON OBJECTS (LAST_ACCESS);')
+            conn.execute('CREATE TABLE IF NOT EXISTS STATS (NAME TEXT PRIMARY KEY, VALUE INTEGER NOT NULL);')
+            conn.executemany('INSERT OR IGNORE INTO STATS (NAME, VALUE) VALUES (?, 0);', [(name,) for name in STATS])
+        self.migrate_json_index()
+
+    def connection(self) -> sqlite3.Connection:
+        # connections can't be shared between threads, or survive a fork
+        if getattr(self.local, 'pid', None) != os.getpid():
+            if hasattr(self.local, 'conn'):
+                # inherited from the parent process: leave well alone (closing it here could upset the parent's locks)
+                self.inherited.append(self.local.conn)
+            conn = sqlite3.connect(self.path, timeout=60)
+            conn.execute('PRAGMA journal_mode=WAL;')
+            conn.execute('PRAGMA synchronous=NORMAL;')
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    def migrate_json_index(self):
+        json_path = os.path.join(os.path.dirname(self.path), 'index.json')
+        if not os.path.isfile(json_path):
+            return
+        try:
+            with open(json_path) as indexf:
+                data = json.load(indexf)
+        except Exception as e:
+            warning(f'Could not read old cache index: {e}')
+            data = dict()
+        with self.connection() as conn:
+            conn.executemany('INSERT OR IGNORE INTO OBJECTS (KEY, PATH, EXPIRES, DEPENDS_ON) VALUES (?, ?, ?, ?);',
+                             [(key, *self.to_row(obj_dict)) for key, obj_dict in data.items()])
+        os.remove(json_path)
+        timestamp(f'Moved {len(data)} entries from index.json to cache index database.')
+
+    @staticmethod
+    def to_row(obj_dict):
+        depends_on = obj_dict.get('depends_on')
+        return obj_dict['path'], obj_dict.get('expires'), None if depends_on is None else json.dumps(depends_on)
+
+    @staticmethod
+    def from_row(path, expires, depends_on) -> CachedObjectData:
+        return CachedObjectData(path=path, expires=expires,
+                                depends_on=None if depends_on is None else json.loads(depends_on))
 
     def __getitem__(self, item) -> CachedObjectData:
-        data = self.read()
-        return CachedObjectData(**data[item])
+        row = self.connection().execute('SELECT PATH, EXPIRES, DEPENDS_ON FROM OBJECTS WHERE KEY=?;',
+                                        (item,)).fetchone()
+        if row is None:
+            raise KeyError(item)
+        return self.from_row(*row)
 
     def __setitem__(self, key, value):
-        data = self.read()
-        data[key] = value
-        self.write(data)
+        with self.connection() as conn:
+            conn.execute('INSERT OR REPLACE INTO OBJECTS (KEY, PATH, EXPIRES, DEPENDS_ON, LAST_ACCESS) '
+                         'VALUES (?, ?, ?, ?, ?);', (key, *self.to_row(value), time.time()))
 
     def __contains__(self, key):
-        data = self.read()
-        return key in data
+        return self.connection().execute('SELECT 1 FROM OBJECTS WHERE KEY=?;', (key,)).fetchone() is not None
+
+    def __len__(self):
+        return self.connection().execute('SELECT COUNT(*) FROM OBJECTS;').fetchone()[0]
 
     def remove(self, key: str):
-        data = self.read()
-        del data[key]
-        self.write(data)
+        with self.connection() as conn:
+            conn.execute('DELETE FROM OBJECTS WHERE KEY=?;', (key,))
+
+    def touch(self, key, size=None):
+        '''Note that the object KEY has just been used (and, if given, its SIZE in bytes).'''
+        with self.connection() as conn:
+            if size is None:
+                conn.execute('UPDATE OBJECTS SET LAST_ACCESS=? WHERE KEY=?;', (time.time(), key))
+            else:
+                conn.execute('UPDATE OBJECTS SET LAST_ACCESS=?, SIZE=? WHERE KEY=?;', (time.time(), size, key))
+
+    def total_size(self):
+        conn = self.connection()
+        unsized = conn.execute('SELECT KEY, PATH FROM OBJECTS WHERE SIZE IS NULL;').fetchall()
+        if unsized:
+            # e.g. entries from before sizes were recorded
+            with conn:
+                conn.executemany('UPDATE OBJECTS SET SIZE=? WHERE KEY=?;',
+                                 [(colcache.get_size(path) if os.path.exists(path) else 0, key) for key, path in unsized])
+        return conn.execute('SELECT COALESCE(SUM(SIZE), 0) FROM OBJECTS;').fetchone()[0]
+
+    def least_recently_used(self):
+        '''Yields (key, path, size) of cached objects, least recently used first.'''
+        yield from self.connection().execute('SELECT KEY, PATH, COALESCE(SIZE, 0) FROM OBJECTS '
+                                             'ORDER BY LAST_ACCESS ASC;').fetchall()
+
+    def count(self, name, n=1):
+        with self.connection() as conn:
+            conn.execute('UPDATE STATS SET VALUE=VALUE+? WHERE NAME=?;', (n, name))
+
+    def get_stats(self) -> dict:
+        return dict(self.connection().execute('SELECT NAME, VALUE FROM STATS;').fetchall())
 
     def items(self):
-        data = self.read()
-        for key, obj_dict in data.items():
-            yield key, CachedObjectData(**obj_dict)
-
-    @lru_cache
-    def read(self) -> dict:
-        with open(self.path) as indexf:
-            fc = indexf.read()
-        try:
-            index = json.loads(fc)
-        except:
-            warning(f'Error encountered while parsing index "{fc}".')
-            raise
-        return index
+        rows = self.connection().execute('SELECT KEY, PATH, EXPIRES, DEPENDS_ON FROM OBJECTS;').fetchall()
+        for key, *row in rows:
+            yield key, self.from_row(*row)
+
+
+
+def get_file_stamp(path):
+    st = os.stat(path)
+    return st.st_ino, st.st_mtime_ns
+
+
+def find_file_stamp(path):
+    '''As get_file_stamp, but None if there is nothing at PATH.'''
+    try:
+        return get_file_stamp(path)
+    except FileNotFoundError:
+        return None
+
+
+
+class MemoryTier:
+    '''
+    Objects recently loaded from the disk cache, kept in memory up to MAX_BYTES in total (objects are measured by the
+    size of their cached files). Least recently used objects are dropped first. Each object is stored with the stamp of
+    its file, so a copy that has since been rewritten on disk (e.g. by another process) is not used.
+
+    Objects are shared between loads rather than copied: modifying one in place modifies what later loads return.
+    '''
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.objects = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
 
-    def write(self, data: dict):
-        with open(self.path, 'w') as indexf:
-            json.dump(data, indexf)
+    def get(self, key, stamp):
+        with self.lock:
+            entry = self.objects.get(key)
+            if entry is None or entry[2] != stamp:
+                self.misses += 1
+                return None
+            self.objects.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, obj, size, stamp):
+        with self.lock:
+            self._discard(key)
+            if size > self.max_bytes:
+                return
+            self.objects[key] = obj, size, stamp
+            self.size += size
+            while self.size > self.max_bytes:
+                __, (__, size, __) = self.objects.popitem(last=False)
+                self.size -= size
+
+    def discard(self, key):
+        with self.lock:
+            self._discard(key)
+
+    def _discard(self, key):
+        entry = self.objects.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        with self.lock:
+            self.objects.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self.objects)
 
 
 
@@ -106,31 +302,65 @@ class CacheSingleton:
     def __init__(self, *args, **kwargs):
         self.check_paths()
         self.index = CacheIndex(*args, **kwargs)
-        self.clean()
+        self.max_bytes = MAX_CACHE_BYTES
+        self.memory = MemoryTier(MAX_MEMORY_BYTES) if MAX_MEMORY_BYTES else None
+        # objects are validated as they are loaded (see is_cached), rather than all up front
+        if SWEEP_CACHE:
+            self.start_sweep()
         timestamp(f'Cache at \'{self.path}\' initialised.')
 
-    def clean(self):
-        marked_for_removal = list()
+    def clean(self, pause=None):
+        '''Check every object in the cache, removing those which are invalid. Sleeps for PAUSE seconds between objects.'''
+        marked_for_removal = dict()
         for key, obj_data in self.index.items():
+            # stamped before checking, so an object replaced in the meantime is left alone
+            stamp = find_file_stamp(obj_data.path)
             if obj_data.is_invalid():
-                marked_for_removal.append(key)
-        self.remove(marked_for_removal)
+                marked_for_removal[key] = stamp
+            if pause:
+                time.sleep(pause)
+        for key, stamp in marked_for_removal.items():
+            self.remove(key, stamp=stamp)
         n = len(marked_for_removal)
         if n:
             s = 's' if n > 1 else ''
             warning(f'Removed {n} invalid object{s} from cache.')
+        self.remove_stale_temporaries()
+
+    def remove_stale_temporaries(self):
+        now = time.time()
+        for name in os.listdir(self.path):
+            path = os.path.join(self.path, name)
+            if ('.tmp-' in name or '.old-' in name) and now - os.path.getmtime(path) > STALE_TEMP_SECONDS:
+                colcache.remove(path)
+
+    @contextmanager
+    def lock(self, shared=False):
+        '''
+        Advisory lock on the cache, shared between processes (and threads, as each acquisition opens the lock file
+        afresh). Writers hold it exclusively while moving objects into place and updating the index; readers hold it
+        shared while opening an object, after which the object can't change under them. Not re-entrant.
+        '''
+        if fcntl is None:
+            yield
+            return
+        with open(f'{self.path}/lock', 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            yield
+
+    def start_sweep(self, pause=0.001):
+        '''Clean the cache in a background thread, which goes gently so as not to compete with queries.'''
+        thread = threading.Thread(target=self.clean, kwargs=dict(pause=pause), daemon=True)
+        thread.start()
+        return thread
 
     def check_paths(self):
         if not os.path.isdir(self.path):
             os.makedirs(self.path)
 
-        if not os.path.isfile(f'{self.path}/index.json'):
-            with open(f'{self.path}/index.json', 'w') as indexf:
-                json.dump(dict(), indexf)
-
-    def get_hashed_name(self, name: str, returns='both'):
+    def get_hashed_name(self, name: str, returns='both', fmt='pickle'):
         hsh = hashlib.sha1(name.encode()).hexdigest()
-        name = f'{self.path}/{hsh}.pickle'
+        name = f'{self.path}/{hsh}.{CACHE_FORMATS[fmt]}'
         if returns == 'both':
             return name, hsh
         elif returns == 'hash':
@@ -142,66 +372,197 @@ class CacheSingleton:
     def get_path_in_cache_of(self, key):
         return self.index[key].path
 
-    def save_object(self, key, obj, depends_on=None, expires=None, expires_in_seconds=None, expires_in_days=None):
-        name, hsh = self.get_hashed_name(key)
-
-        if key not in self.index:
-            obj_data = CachedObjectData(path=name)
-            obj_data.path = name
+    def save_object(self, key, obj, depends_on=None, expires=None, expires_in_seconds=None, expires_in_days=None,
+                    fmt='pickle'):
+        if fmt not in CACHE_FORMATS:
+            raise ValueError(f'Unknown cache format \'{fmt}\'. Valid formats are: {", ".join(CACHE_FORMATS)}.')
+        name, hsh = self.get_hashed_name(key, fmt=fmt)
 
-            if depends_on:
-                if isinstance(depends_on, str):
-                    depends_on = [depends_on]
-                obj_data.depends_on = depends_on
+        obj_data = CachedObjectData(path=name)
+        obj_data.path = name
 
-            if expires is not None:
-                obj_data.expires = expires
-            elif expires_in_seconds is not None:
-                obj_data.expires = time.time() + expires_in_seconds
-            elif expires_in_days is not None:
-                obj_data.expires = time.time() + (expires_in_days * 60. * 60. * 24.)
+        if depends_on:
+            if isinstance(depends_on, str):
+                depends_on = [depends_on]
+            obj_data.depends_on = depends_on
 
-            self.index[key] = obj_data.as_dict()
+        if expires is not None:
+            obj_data.expires = expires
+        elif expires_in_seconds is not None:
+            obj_data.expires = time.time() + expires_in_seconds
+        elif expires_in_days is not None:
+            obj_data.expires = time.time() + (expires_in_days * 60. * 60. * 24.)
 
+        # written out of sight, then moved into place: readers never see a partial object
         timestamp(f'Saving object {hsh[:3]}...{hsh[-3:]} to cache.')
-        with open(name, 'wb') as pf:
-            pickle.dump(obj, pf, protocol=4)
+        tmp_name = f'{name}.tmp-{os.getpid()}-{threading.get_ident()}'
+        try:
+            if fmt == 'columns':
+                colcache.dump(obj, tmp_name)
+            else:
+                with open(tmp_name, 'wb') as pf:
+                    pickle.dump(obj, pf, protocol=4)
+            size = colcache.get_size(tmp_name)
+
+            with self.lock():
+                old_path = self.index[key].path if key in self.index else None
+                colcache.replace(tmp_name, name)
+                if old_path and old_path != name:
+                    # previously saved in a different format
+                    colcache.remove(old_path)
+                self.index[key] = obj_data.as_dict()
+                self.index.touch(key, size=size)
+        finally:
+            colcache.remove(tmp_name)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        '''Remove least recently used objects (other than KEEP) until the cache is within its size budget.'''
+        if self.max_bytes is None:
+            return
+
+        total = self.index.total_size()
+        if total <= self.max_bytes:
+            return
+
+        n, reclaimed = 0, 0
+        with self.lock():
+            for key, path, size in self.index.least_recently_used():
+                if total <= self.max_bytes:
+                    break
+                if key == keep:
+                    continue
+                colcache.remove(path)
+                self.index.remove(key)
+                if self.memory is not None:
+                    self.memory.discard(key)
+                total -= size
+                reclaimed += size
+                n += 1
 
-    def load_object(self, key):
+        if n:
+            self.index.count('evictions', n)
+            self.index.count('reclaimed_bytes', reclaimed)
+            s = 's' if n > 1 else ''
+            warning(f'Evicted {n} least recently used object{s} ({fmt_bytes(reclaimed)}) to keep cache within '
+                    f'{fmt_bytes(self.max_bytes)}.')
+
+    def stats(self) -> dict:
+        rv = self.index.get_stats()
+        rv['objects'] = len(self.index)
+        rv['size_bytes'] = self.index.total_size()
+        rv['max_bytes'] = self.max_bytes
+        lookups = rv['hits'] + rv['misses']
+        rv['hit_rate'] = rv['hits'] / lookups if lookups else None
+        if self.memory is not None:
+            # of this process only
+            rv['memory_objects'] = len(self.memory)
+            rv['memory_bytes'] = self.memory.size
+            rv['memory_max_bytes'] = self.memory.max_bytes
+            rv['memory_hits'] = self.memory.hits
+            rv['memory_misses'] = self.memory.misses
+        return rv
+
+    def print_stats(self):
+        stats = self.stats()
+        hit_rate = f'{stats["hit_rate"]*100:.1f}%' if stats['hit_rate'] is not None else 'n/a'
+        budget = fmt_bytes(stats['max_bytes']) if stats['max_bytes'] else 'unlimited'
+        timestamp(f'Cache at \'{self.path}\':')
+        timestamp(f'  {stats["objects"]} objects, {fmt_bytes(stats["size_bytes"])} (budget: {budget})')
+        timestamp(f'  {stats["hits"]} hits, {stats["misses"]} misses (hit rate {hit_rate})')
+        timestamp(f'  {stats["evictions"]} objects evicted, {fmt_bytes(stats["reclaimed_bytes"])} reclaimed')
+        if self.memory is not None:
+            timestamp(f'  In memory: {stats["memory_objects"]} objects, {fmt_bytes(stats["memory_bytes"])} '
+                      f'(budget: {fmt_bytes(stats["memory_max_bytes"])}), {stats["memory_hits"]} hits, '
+                      f'{stats["memory_misses"]} misses')
+
+    def is_cached(self, key):
         if key not in self.index:
-            warning('Key not in index.')
-            return None
+            self.index.count('misses')
+            return False
 
         if '--fresh' in sys.argv:
             warning('Clearing cached version of requested object.')
             self.remove(key)
-            return None
+            self.index.count('misses')
+            return False
 
-        obj_data = self.index[key]
-        if reason := obj_data.is_invalid():
+        try:
+            # under the lock, so as not to catch an object part way through being replaced
+            with self.lock(shared=True):
+                obj_data = self.index[key]
+                stamp = find_file_stamp(obj_data.path)
+                reason = obj_data.is_invalid()
+        except KeyError:
+            self.index.count('misses')
+            return False
+
+        if reason:
             warning(reason)
-            self.remove(key)
+            self.remove(key, stamp=stamp)
+            self.index.count('misses')
+            return False
+
+        return True
+
+    def load_object(self, key):
+        if key not in self.index:
+            warning('Key not in index.')
+            self.index.count('misses')
+            return None
+
+        if not self.is_cached(key):
             return None
 
         try:
-            with open(obj_data.path, 'rb') as pf:
-                o = pickle.load(pf)
+            pf = None
+            with self.lock(shared=True):
+                path = self.index[key].path
+                stamp = get_file_stamp(path)
+                o = self.memory.get(key, stamp) if self.memory is not None else None
+                if o is None:
+                    if os.path.isdir(path):
+                        # arrays are mapped, not read, so this is quick
+                        o = colcache.load(path)
+                    else:
+                        pf = open(path, 'rb')
+            if pf is not None:
+                with pf:
+                    o = pickle.load(pf)
+            if self.memory is not None:
+                self.memory.put(key, o, colcache.get_size(path), stamp)
         except Exception as e:
             warning(f'Error loading cached file: {e}')
             self.remove(key)
+            self.index.count('misses')
             return None
+        self.index.touch(key)
+        self.index.count('hits')
         return o
 
-    def remove(self, key: [str, list]):
+    def remove(self, key: [str, list], stamp=ANY_STAMP):
+        '''
+        Remove KEY (or list of keys) from the cache. If STAMP is given (see find_file_stamp), only if KEY's object is
+        still the one with that stamp: i.e. it hasn't been replaced since it was found invalid.
+        '''
         if isinstance(key, list):
             for k in key:
                 self.remove(k)
         else:
-            path = self.index[key].path
-            os.remove(path)
+            with self.lock():
+                try:
+                    path = self.index[key].path
+                except KeyError:
+                    # already removed (e.g. by another thread or process)
+                    return
+                if stamp is not ANY_STAMP and stamp != find_file_stamp(path):
+                    return
+                colcache.remove(path)
+                self.index.remove(key)
+            if self.memory is not None:
+                self.memory.discard(key)
             hsh = self.get_hashed_name(key, returns='hash')
             warning(f'Deleted object {hsh[:3]}...{hsh[-3:]} from cache.')
-            self.index.remove(key)
 
     def load_object_or_run_script(self, key, script_path):
         o = self.load_object(key)
@@ -227,15 +588,130 @@ def Cache() -> CacheSingleton:
     return __cache
 
 
-def diskcache(thisfile=None, **cache_kwargs):
+def hash_argument(h, obj, _seen=None):
+    '''
+    Update the hash H with the contents of OBJ: arrays by their data, dtype, and shape rather than their repr, and other
+    objects (e.g. logs) by their attributes, so that equal logs hash equally however they were loaded.
+    '''
+    if isinstance(obj, np.ndarray):
+        h.update(f'ndarray {obj.dtype.str} {obj.shape}'.encode())
+        if obj.dtype.hasobject:
+            hash_argument(h, obj.tolist(), _seen)
+        else:
+            h.update(np.ascontiguousarray(obj).data)
+    elif isinstance(obj, (str, bytes, int, float, complex, bool, type(None))):
+        h.update(f'{type(obj).__name__} {obj!r}'.encode())
+    elif isinstance(obj, type) or inspect.isbuiltin(obj):
+        # classes and builtins by name (their attributes include memory addresses)
+        h.update(f'{getattr(obj, "__module__", None)}.{obj.__qualname__}'.encode())
+    elif isinstance(obj, Enum):
+        h.update(f'{type(obj).__module__}.{type(obj).__qualname__}.{obj.name}'.encode())
+    elif isinstance(obj, LazyLog):
+        # by what it would load, whether or not it has been loaded yet
+        h.update(b'LazyLog')
+        hash_argument(h, (obj.meta_data, obj.table, obj.kwargs), _seen)
+    else:
+        _seen = _seen or set()
+        if id(obj) in _seen:
+            # reference back to an object already being hashed
+            h.update(b'cycle')
+            return
+        _seen.add(id(obj))
+        if inspect.isfunction(obj):
+            # by what calling it would do: its code, and the values it was defined with
+            h.update(f'function {obj.__module__}.{obj.__qualname__}'.encode())
+            hash_code(h, obj.__code__)
+            hash_argument(h, (obj.__defaults__, obj.__kwdefaults__), _seen)
+            for cell in obj.__closure__ or ():
+                try:
+                    hash_argument(h, cell.cell_contents, _seen)
+                except ValueError:
+                    h.update(b'empty cell')
+        elif inspect.ismethod(obj):
+            h.update(b'method')
+            hash_argument(h, (obj.__func__, obj.__self__), _seen)
+        elif isinstance(obj, functools.partial):
+            h.update(b'partial')
+            hash_argument(h, (obj.func, obj.args, obj.keywords), _seen)
+        elif isinstance(obj, (list, tuple)):
+            h.update(f'{type(obj).__name__} {len(obj)}'.encode())
+            for v in obj:
+                hash_argument(h, v, _seen)
+        elif isinstance(obj, (set, frozenset)):
+            # in the order of their hashes, as a set's own order can differ between sessions
+            h.update(f'{type(obj).__name__} {len(obj)}'.encode())
+            digests = list()
+            for v in obj:
+                vh = hashlib.sha1()
+                hash_argument(vh, v, _seen)
+                digests.append(vh.digest())
+            for digest in sorted(digests):
+                h.update(digest)
+        elif isinstance(obj, dict):
+            h.update(f'dict {len(obj)}'.encode())
+            for k, v in sorted(obj.items(), key=lambda kv: repr(kv[0])):
+                hash_argument(h, k, _seen)
+                hash_argument(h, v, _seen)
+        elif hasattr(obj, '__dict__'):
+            h.update(f'{type(obj).__module__}.{type(obj).__qualname__}'.encode())
+            hash_argument(h, vars(obj), _seen)
+        else:
+            h.update(f'{type(obj).__module__}.{type(obj).__qualname__} {obj!r}'.encode())
+        _seen.discard(id(obj))
+
+
+def hash_code(h, code):
+    '''Update the hash H with compiled CODE: its bytecode, the names it uses, and its constants (nested code too).'''
+    h.update(code.co_code)
+    h.update(repr(code.co_names).encode())
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            hash_code(h, const)
+        else:
+            hash_argument(h, const)
+
+
+def hash_arguments(args, kwargs):
+    h = hashlib.sha1()
+    hash_argument(h, args)
+    hash_argument(h, kwargs)
+    return h.hexdigest()
+
+
+def get_code_hash(f):
+    '''Returns a hash of the source of function F or, if the source isn't available, of its bytecode.'''
+    h = hashlib.sha1()
+    try:
+        h.update(inspect.getsource(f).encode())
+    except (OSError, TypeError):
+        hash_code(h, f.__code__)
+    return h.hexdigest()
+
+
+def diskcache(thisfile=None, depends_on=None, **cache_kwargs):
+    '''
+    Decorator caching the return value of a function to disk. Results are keyed on the function's code and the contents
+    of its arguments, so editing the function or passing different data gives a fresh result.
+
+    Cached results are invalidated when THISFILE changes, or any of DEPENDS_ON: paths, or row dependencies (see
+    rheoproc.sql.get_row_dependency). DEPENDS_ON may also be a function, called with the decorated function's arguments,
+    returning the dependencies of that call.
+    '''
     def decorator(f):
+        code_hash = get_code_hash(f)
+
+        @functools.wraps(f)
         def decorated_f(*args, **kwargs):
-            key = f'{thisfile} {args} {kwargs}'
+            key = f'DISKCACHE: {f.__module__}.{f.__qualname__}, CODE: {code_hash}, ARGS: {hash_arguments(args, kwargs)}'
             cache = Cache()
             val = cache.load_object(key)
             if val is None:
                 rv = f(*args, **kwargs)
-                cache.save_object(key, rv, depends_on=thisfile, **cache_kwargs)
+                dependencies = depends_on(*args, **kwargs) if callable(depends_on) else depends_on
+                if isinstance(dependencies, (str, dict)):
+                    dependencies = [dependencies]
+                dependencies = [thisfile, *(dependencies or [])] if thisfile else dependencies
+                cache.save_object(key, rv, depends_on=dependencies, **cache_kwargs)
                 return rv
             else:
                 return val
@@ -2,104 +2,71 @@
 # This file contains functions relevant to connecting to a remote processing server (see rheoproc.server)
 
 import socket
-import pickle
-import json
-from zlib import decompress
-import time
 
 from rheoproc.port import PORT
-from rheoproc.progress import ProgressBar
+from rheoproc.protocol import Connection
 from rheoproc.error import timestamp
 
-def read_message(sock):
-    data = b''
-    while b := sock.recv(1):
-        data += b
-        s = b.decode()
-        if s == '}':
-            break
-    return json.loads(data.decode())
 
-class DownloadSpeedo:
+def connect(server_addr, timeout, args, kwargs, have=None):
+    s = socket.create_connection((server_addr, PORT), timeout=timeout)
+    # timeout applies to connecting only: the server may be busy processing for some time
+    s.settimeout(None)
+    conn = Connection(s)
+    timestamp(f'Querying rheoproc server at {server_addr}:{PORT}')
+    conn.send_message('request', (args, kwargs, have or dict()), codec='pickle')
+    return s, conn
 
-    def __init__(self):
-        self.start_time = time.time()
 
+def recv_until(conn, *m_types):
+    '''Receive messages, showing any status updates, until one of M_TYPES arrives. Returns its type and content.'''
+    while True:
+        m_type, msg = conn.recv_message()
+        if m_type in m_types:
+            return m_type, msg
+        elif m_type == 'exception':
+            raise Exception(msg)
+        elif m_type == 'status':
+            timestamp('remote:', msg)
 
-    def info(self, tot, current):
-        dt = time.time() - self.start_time
-        speed = current / dt
-        unit = 'b'
-        if speed > 1024:
-            speed /= 1024
-            unit = 'kb'
-        if speed > 1024:
-            speed /= 1024
-            unit = 'Mb'
-        return f'{speed:.1f} {unit}/s'
 
-
-def get_from_server(server_addr, *args, timeout=10, **kwargs):
-    data = (args, kwargs)
-    data_encoded = pickle.dumps(data)
-
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-        s.settimeout(timeout)
-        s.connect( (server_addr, PORT) )
-        timestamp(f'Querying rheoproc server at {server_addr}:{PORT}')
-        s.sendall(data_encoded)
-
-        BUFFLEN = 4096
-        size = -1
+def iter_from_server(server_addr, *args, timeout=10, have=None, **kwargs):
+    '''
+    Yields (index, ID, stamp, log) for each log of the query as soon as the server sends it, INDEX being its position in
+    the query's results. Logs in HAVE ({ID: stamp}) whose stamp is still current on the server are not sent: log is None
+    for these. Logs are sent in the columnar wire format (rheoproc.wire); pass wire_float32=True to have their arrays
+    sent as float32, halving the transfer at the cost of precision.
+    '''
+    s, conn = connect(server_addr, timeout, args, kwargs, have)
+    with s:
+        n_sent, n_held = 0, 0
         while True:
-            msg = read_message(s)
-            if msg['type'] == 'exception':
-                raise Exception(msg['exception'])
-            elif msg['type'] == 'status':
-                timestamp('remote:', msg['status'])
-            elif msg['type'] == 'preamble':
-                size = msg['size']
+            m_type, msg = recv_until(conn, 'log', 'held', 'end')
+            if m_type == 'end':
                 break
+            elif m_type == 'held':
+                ID, stamp, i = msg
+                n_held += 1
+                yield i, ID, stamp, None
+            else:
+                stamp, log, i = msg
+                n_sent += 1
+                yield i, log.ID, stamp, log
+        conn.close()
+    timestamp(f'Received {n_sent} logs from server ({n_held} already held).')
 
-        unit = 'b'
-        div = 1
-        size_b = int(size)
-        if size > 1024:
-            size /= 1024
-            div *= 1024
-            unit = 'kb'
-        if size > 1024:
-            size /= 1024
-            div *= 1024
-            unit = 'Mb'
-        if size > 1024:
-            size /= 1024
-            div *= 1024
-            unit = 'Gb'
 
-        timestamp(f'Downloading {size:.1f} {unit}')
+def stream_from_server(server_addr, *args, timeout=10, **kwargs):
+    '''Yields each log of the query as soon as the server sends it.'''
+    for __, __, __, log in iter_from_server(server_addr, *args, timeout=timeout, **kwargs):
+        yield log
 
-        data = bytearray()
-        ds = DownloadSpeedo()
-        pb = ProgressBar(size_b + 1, info_func=ds.info)
-        i = 0
-        while part := s.recv(BUFFLEN):
-            data.extend(part)
-            i += 1
-            if i > 1000:
-                i = 0
-                npos = len(data)
-                if npos != pb.pos:
-                    pb.update(npos)
-        pb.update(pb.length)
 
-    try:
-        timestamp('Decompressing data')
-        data = decompress(data)
-    except Exception as e:
-        timestamp(f'Error while decompressing: {e}')
-        pass
-    data = pickle.loads(data)
-    if isinstance(data, str):
-        raise Exception(data)
-    return data
+def get_rows_from_server(server_addr, *args, timeout=10, **kwargs):
+    '''Returns the database rows of the query (as dicts), without any processing.'''
+    kwargs['process_results'] = False
+    s, conn = connect(server_addr, timeout, args, kwargs)
+    with s:
+        m_type, rows = recv_until(conn, 'result')
+        conn.close()
+    return rows
@@ -0,0 +1,89 @@
+# rheoproc.colcache
+# Columnar on-disk format for cached logs: a directory holding each numeric array of the log as a raw .npy file, the
+# rest of the log pickled with the arrays replaced by references (see rheoproc.wire), and a JSON sidecar describing
+# the columns. Arrays are memory-mapped on loading, so opening a cached log is quick whatever its size, and only the
+# parts of the arrays actually used are read from disk.
+
+import os
+import json
+import shutil
+import threading
+
+import numpy as np
+
+from rheoproc.wire import ColumnPickler, ColumnUnpickler
+
+
+META_NAME = 'meta.json'
+SKELETON_NAME = 'skeleton.pickle'
+
+
+def get_size(path):
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+    return os.path.getsize(path)
+
+
+def remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path, ignore_errors=True)
+    elif os.path.isfile(path):
+        os.remove(path)
+
+
+def dump(obj, path):
+    '''Write OBJ to the new directory PATH.'''
+    os.makedirs(path)
+
+    with open(os.path.join(path, SKELETON_NAME), 'wb') as f:
+        pickler = ColumnPickler(f)
+        pickler.dump(obj)
+
+    columns = list()
+    for i, (kind, arr, __) in enumerate(pickler.columns):
+        name = f'{i:04d}.npy'
+        np.save(os.path.join(path, name), arr, allow_pickle=False)
+        columns.append({'name': name, 'kind': kind})
+
+    with open(os.path.join(path, META_NAME), 'w') as f:
+        json.dump({'columns': columns}, f)
+
+
+def replace(src, dst):
+    '''
+    Move the file or directory SRC to DST, replacing whatever is there. Files are replaced atomically; a directory is
+    swapped in with two renames, so DST is briefly missing (callers lock against readers, see rheoproc.cache).
+    '''
+    if not os.path.isdir(src):
+        os.replace(src, dst)
+        return
+
+    old = None
+    if os.path.exists(dst):
+        old = f'{dst}.old-{os.getpid()}-{threading.get_ident()}'
+        os.rename(dst, old)
+    os.rename(src, dst)
+    if old:
+        # anything still mapping the old columns keeps them until it lets go
+        remove(old)
+
+
+def load(path):
+    '''Returns the object stored in the directory PATH, with its arrays memory-mapped (copy-on-write).'''
+    with open(os.path.join(path, META_NAME)) as f:
+        meta = json.load(f)
+
+    columns = list()
+    for col in meta['columns']:
+        col_path = os.path.join(path, col['name'])
+        if col['kind'] == 'list':
+            columns.append(np.load(col_path).tolist())
+        else:
+            try:
+                columns.append(np.load(col_path, mmap_mode='c'))
+            except ValueError:
+                # e.g. empty arrays, which can't be mapped
+                columns.append(np.load(col_path))
+
+    with open(os.path.join(path, SKELETON_NAME), 'rb') as f:
+        return ColumnUnpickler(f, columns).load()
@@ -34,6 +34,10 @@ class CategoryError(GenericRheoprocException):
     '''The data you requested cannot be found. The category for the data was not requested.'''
 
 
+class FieldError(GenericRheoprocException):
+    '''The field you requested is not one which processing produces.'''
+
+
 class DataUnavailableError(GenericRheoprocException):
     '''The data you requested is missing in the original log file and therefore cannot be obtained.'''
 
@@ -0,0 +1,62 @@
+# rheoproc.lazylog
+# A stand-in for a log which holds only its database row until its data are needed. The log is then processed (or
+# loaded from the cache) on first access, so a large group can be filtered on its metadata without processing the logs
+# which are thrown away.
+
+from datetime import datetime
+
+from rheoproc.varproplog import VariablePropertiesLog
+from rheoproc.exception import DataUnavailableError
+
+
+class LazyLog(VariablePropertiesLog):
+    '''
+    Proxy for a log which is only processed when its data are first accessed. Metadata from the database row (ID,
+    material, tags, setpoint, date) are available straight away; any other attribute is read from the processed log.
+    '''
+
+    def __init__(self, row, table, database, **kwargs):
+        super().__init__()
+        self.meta_data = dict(row)
+        self.table = table
+        self.database = database
+        self.kwargs = kwargs
+        self.log = None
+
+        self.ID = self.meta_data['ID']
+        self.material = self.meta_data.get('MATERIAL')
+        self.setpoint = self.meta_data.get('SETPOINT')
+        tags = self.meta_data.get('TAGS')
+        self.tags = tags.split(';') if tags else list()
+        date = self.meta_data.get('DATE')
+        self.date = datetime.strptime(date, '%Y-%m-%d') if date else None
+
+
+    def __repr__(self):
+        state = 'processed' if self.log is not None else 'not processed'
+        return f'LazyLog({{ID={self.ID}, MATERIAL={self.material}, TAGS={";".join(self.tags)}}}, {state})'
+
+
+    def load(self):
+        if self.log is None:
+            from rheoproc.query import load_or_process_log
+            log = load_or_process_log(self.meta_data, self.table, self.database, **self.kwargs)
+            if log is None:
+                raise DataUnavailableError(f'Log {self.ID} could not be processed (exception ignored).')
+            self.log = log
+            self.data = self.log.data
+            self.cat = getattr(self.log, 'cat', None)
+        return self.log
+
+
+    def get(self, prop):
+        if prop not in self.data:
+            self.load()
+        return super().get(prop)
+
+
+    def __getattr__(self, name):
+        # only called when the attribute isn't found on the proxy: pass on to the processed log
+        if name.startswith('_') or 'meta_data' not in self.__dict__:
+            raise AttributeError(name)
+        return getattr(self.load(), name)
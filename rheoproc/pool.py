@@ -0,0 +1,97 @@
+# rheoproc.pool
+# Manages a pool of worker processes which is created on first use and then kept for the whole session, so repeated
+# queries don't pay the process start-up (and numpy/scipy/cv2 import) cost every time. Call shutdown() to release it
+# early; it is shut down automatically on exit.
+
+import atexit
+import time
+import threading
+import multiprocessing as mp
+from queue import Empty
+
+from rheoproc.error import __print as raw_print, timestamp
+from rheoproc.transport import clean_transport_dir
+
+__lock = threading.Lock()
+__pool = None
+__processes = None
+__manager = None
+__q = None
+__printer_thread = None
+__pb = None
+
+
+def printer(q: mp.Queue):
+    while True:
+        try:
+            pl = q.get(timeout=10)
+        except Empty:
+            time.sleep(0.1)
+            continue
+        except (EOFError, OSError):
+            break
+        if isinstance(pl, int):
+            break
+        args, kwargs = pl
+        if __pb is not None:
+            __pb.print(*args, **kwargs)
+        else:
+            raw_print(*args, **kwargs)
+
+
+def set_progress_bar(pb):
+    '''Set the progress bar through which messages from the workers are printed.'''
+    global __pb
+    __pb = pb
+
+
+def get_pool(processes):
+    '''
+    Returns the session's worker pool and the queue workers use to send messages back to this process. The pool is
+    created if it doesn't exist yet, or re-created if it has a different number of PROCESSES.
+    '''
+    global __pool, __processes, __manager, __q, __printer_thread
+
+    with __lock:
+        if __pool is not None and __processes != processes:
+            timestamp(f'Resizing worker pool from {__processes} to {processes} processes.')
+            _shutdown()
+
+        if __pool is None:
+            mp.set_start_method('fork', True)
+            __manager = mp.Manager()
+            __q = __manager.Queue()
+            __printer_thread = threading.Thread(target=printer, args=(__q,), daemon=True)
+            __printer_thread.start()
+            __pool = mp.Pool(processes=processes)
+            __processes = processes
+
+        return __pool, __q
+
+
+def _shutdown():
+    global __pool, __processes, __manager, __q, __printer_thread
+
+    if __pool is None:
+        return
+
+    __pool.terminate()
+    __pool.join()
+    try:
+        __q.put(0)
+        __printer_thread.join()
+        __manager.shutdown()
+    except (EOFError, OSError):
+        # manager has already gone (e.g. torn down at exit)
+        pass
+    clean_transport_dir()
+    __pool, __processes, __manager, __q, __printer_thread = None, None, None, None, None
+
+
+def shutdown():
+    '''Stop the worker processes. A new pool will be created if another query needs one.'''
+    with __lock:
+        _shutdown()
+
+
+atexit.register(shutdown)
@@ -1,7 +1,7 @@
 # rheproc.progress
 # flexible progress indicator class
 
-import os
+import shutil
 from threading import Lock
 
 from rheoproc.error import __print as raw_print, timestamp
@@ -12,7 +12,8 @@ class ProgressBar:
         self.length = length
         self.pos = -1
         self.lock = Lock()
-        self.columns = int(os.popen('stty size', 'r').read().split()[1])
+        # falls back to 80 columns when not attached to a terminal (e.g. when warming the cache from cron)
+        self.columns = shutil.get_terminal_size(fallback=(80, 24)).columns
         self.info_func = info_func
 
     def update(self, i=None):
@@ -0,0 +1,101 @@
+# rheoproc.protocol
+# Framing of messages between the procserver and its clients. Each frame is a fixed-size header (message type, payload
+# codec, payload length) followed by the payload. Both ends read through a large buffer, so neither byte-at-a-time
+# reads nor assumptions about how much arrives in one recv() are needed. Results are sent a log at a time, so neither end
+# needs to hold the whole result in memory.
+
+import json
+import pickle
+import struct
+from zlib import compress, decompress
+
+from rheoproc import wire
+
+
+HEADER = struct.Struct('!BBQ')
+BUFFER_SIZE = 1 << 20
+
+# numbered by position in the header: new types and codecs go on the end ('chunk', 'zlib', and 'zstd' are no longer used)
+MESSAGE_TYPES = ['request', 'status', 'exception', 'result', 'chunk', 'end', 'log', 'held']
+CODECS = ['raw', 'json', 'pickle', 'zlib-pickle', 'zlib', 'zstd', 'wire', 'wire-float32']
+
+
+def encode(obj, codec):
+    if codec == 'raw':
+        return bytes(obj)
+    if codec == 'json':
+        return json.dumps(obj).encode()
+    if codec == 'pickle':
+        return pickle.dumps(obj, protocol=4)
+    if codec == 'zlib-pickle':
+        return compress(pickle.dumps(obj, protocol=4), 1)
+    if codec == 'wire':
+        return wire.dumps(obj)
+    if codec == 'wire-float32':
+        return wire.dumps(obj, float32=True)
+    raise ValueError(f'Unknown codec \'{codec}\'. Valid codecs are: {", ".join(CODECS)}.')
+
+
+def decode(payload, codec):
+    if codec == 'raw':
+        return payload
+    if codec == 'json':
+        return json.loads(payload.decode())
+    if codec == 'pickle':
+        return pickle.loads(payload)
+    if codec == 'zlib-pickle':
+        return pickle.loads(decompress(payload))
+    if codec in ['wire', 'wire-float32']:
+        return wire.loads(payload)
+    raise ValueError(f'Unknown codec \'{codec}\'. Valid codecs are: {", ".join(CODECS)}.')
+
+
+class Connection:
+    '''Sends and receives framed messages over the connected socket SOCK.'''
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb', buffering=BUFFER_SIZE)
+
+    def close(self):
+        self.rfile.close()
+
+    def send_frame(self, m_type, payload, codec='raw'):
+        header = HEADER.pack(MESSAGE_TYPES.index(m_type), CODECS.index(codec), len(payload))
+        if len(payload) < BUFFER_SIZE:
+            self.sock.sendall(header + payload)
+        else:
+            self.sock.sendall(header)
+            self.sock.sendall(payload)
+
+    def send_message(self, m_type, obj, codec='json'):
+        self.send_frame(m_type, encode(obj, codec), codec)
+
+    def read_exactly(self, n, progress=None):
+        if progress is None:
+            data = self.rfile.read(n)
+        else:
+            data = bytearray()
+            while len(data) < n:
+                part = self.rfile.read(min(BUFFER_SIZE, n - len(data)))
+                if not part:
+                    break
+                data.extend(part)
+                progress(len(data))
+            data = bytes(data)
+        if len(data) < n:
+            raise ConnectionError(f'Connection closed ({len(data)} of {n} bytes received).')
+        return data
+
+    def recv_header(self):
+        '''Returns the message type, codec, and payload length of the next frame.'''
+        m_type, codec, length = HEADER.unpack(self.read_exactly(HEADER.size))
+        return MESSAGE_TYPES[m_type], CODECS[codec], length
+
+    def recv_payload(self, length, progress=None):
+        return self.read_exactly(length, progress)
+
+    def recv_message(self):
+        '''Returns the message type and decoded payload of the next frame.'''
+        m_type, codec, length = self.recv_header()
+        return m_type, decode(self.recv_payload(length), codec)
@@ -6,20 +6,28 @@
 import os
 import sys
 import time
-from queue import Empty
-import multiprocessing as mp
+import hashlib
 import threading
+from queue import Empty, Queue
+import multiprocessing as mp
 
 from rheoproc.combined import CombinedLogs
-from rheoproc.log import GuessLog, GuessLogType
+from rheoproc.log import GuessLog
+from rheoproc.lazylog import LazyLog
 from rheoproc.exception import GenericRheoprocException, TooManyResultsError, QueryError
 from rheoproc.progress import ProgressBar
-from rheoproc.cache import Cache
-from rheoproc.sql import execute_sql
+from rheoproc.cache import Cache, LOG_CACHE_FORMAT
+from rheoproc.sql import execute_sql, get_row_dependency, track_dependencies, get_tracked_dependencies
 from rheoproc.util import runsh, get_hostname, is_mac
 from rheoproc.error import timestamp, warning
 from rheoproc.interprocess import set_q, set_worker
-from rheoproc.client import get_from_server
+from rheoproc.pool import get_pool, set_progress_bar
+from rheoproc.transport import pack_log, unpack_log
+from rheoproc.tags import get_tag_condition
+from rheoproc.summary import save_summary, load_summaries, is_summary_field
+from rheoproc.schedule import estimate_costs, record_timings, get_timing_key, get_size
+from rheoproc.client import iter_from_server, get_rows_from_server
+from rheoproc.version import version
 
 
 ACCEPTED_TABLES = ['LOGS', 'VIDEOS']
@@ -67,16 +75,21 @@ def get_group(GROUP, database='../data/.database.db', Log=GuessLog, order_by=Non
     assert isinstance(GROUP, (str, list))
 
     if isinstance(GROUP, list):
-        get_sub_group = lambda gi: get_group(gi, Log=Log, order_by=order_by, descending=descending, **kwargs)
         if flat:
-            rv = list()
-            for GROUP_item in GROUP:
-                res = get_sub_group(GROUP_item)
-                for res_item in res:
-                    rv.append(res_item)
-            return rv
+            return get_groups(GROUP, mode='any', database=database, order_by=order_by, descending=descending, **kwargs)
         else:
-            return [get_sub_group(GROUP_item) for GROUP_item in GROUP]
+            return [get_group(GROUP_item, database=database, Log=Log, order_by=order_by, descending=descending, **kwargs)
+                    for GROUP_item in GROUP]
+
+    return get_groups([GROUP], database=database, order_by=order_by, descending=descending, **kwargs)
+
+
+def get_groups(GROUPS, mode='any', database='../data/.database.db', order_by=None, descending=False, **kwargs):
+    '''
+    Get logs tagged with any (MODE='any') or all (MODE='all') of GROUPS, in a single query. Each log is returned once.
+    '''
+
+    assert isinstance(GROUPS, list)
 
     database = os.path.expanduser(database)
 
@@ -87,7 +100,8 @@ def get_group(GROUP, database='../data/.database.db', Log=GuessLog, order_by=Non
     else:
         orderbysql = ""
 
-    return query_db(f'SELECT * FROM LOGS WHERE (TAGS LIKE "%;{GROUP};%" OR TAGS LIKE "{GROUP};%" OR TAGS = "{GROUP}") {orderbysql};', database=database, plain_collection=True, **kwargs)
+    condition = get_tag_condition(GROUPS, mode=mode)
+    return query_db(f'SELECT * FROM LOGS WHERE {condition} {orderbysql};', database=database, plain_collection=True, **kwargs)
 
 
 
@@ -96,6 +110,8 @@ def async_get(args_and_kwargs):
     if q:
         set_q(q)
         set_worker()
+    # note the database rows (calibration, wobble, ...) read while processing: the cached log depends on them
+    track_dependencies()
     try:
         rv = GuessLog(*args, **kwargs)
     except GenericRheoprocException as e:
@@ -105,30 +121,414 @@ def async_get(args_and_kwargs):
             return None
         else:
             raise e
+    finally:
+        dependencies = get_tracked_dependencies()
+    rv.db_dependencies = dependencies
+    if q:
+        rv = pack_log(rv)
     return rv
 
 
+def async_get_indexed(index_and_args_kwargs):
+    i, args_and_kwargs = index_and_args_kwargs
+    before = time.time()
+    rv = async_get(args_and_kwargs)
+    return i, rv, time.time() - before
+
+
 def get_n_processes():
     return mp.cpu_count()
 
 
-def printer(q: mp.Queue, pb: ProgressBar):
-    while True:
+def get_max_processes(max_processes):
+    processes = get_n_processes()
+    if '--max-proc' in sys.argv:
+        max_processes = int(sys.argv[sys.argv.index('--max-proc')+1])
+    return min([processes, max_processes])
+
+
+def get_data_dir(database):
+    return '/'.join(database.split('/')[:-1])
+
+
+def get_table(query):
+    if not query.startswith("SELECT * FROM"):
+        raise QueryError(f'SQL query to database must be in the form "SELECT * FROM <TABLE> [WHERE ...];"\n Troublesome query: {query}')
+
+    table = query.replace(';', '').split(' ')[3]
+
+    if not table in ACCEPTED_TABLES:
+        raise QueryError(f'SQL queries can only be used to access data-containing tables in the database: \n Troublesome table: {table}')
+
+    return table
+
+
+def check_n_results(n, max_results):
+    if n > max_results and get_hostname() != 'Poseidona':
+        raise TooManyResultsError(f"Jeez, that's a lot of data! ({n} > {max_results}, set 'max_results' to override.)")
+
+
+# keyword arguments which affect how a query is run, but not how each log is processed
+NON_PROCESSING_KWARGS = ['returns', 'server', 'stream', 'ordered', 'process_results', 'max_results', 'max_processes',
+                         'ignore_exceptions', 'plain_collection', 'timeout']
+
+
+# keyword arguments which select which of the processed data are kept, but don't change their values
+OUTPUT_KWARGS = ['fields', 'categories', 'averages_only', 'quiet', 'very_quiet']
+
+
+def get_processing_kwargs(kwargs):
+    return {k: v for k, v in sorted(kwargs.items()) if k not in NON_PROCESSING_KWARGS}
+
+
+def get_config_hash(table, kwargs):
+    config = {k: v for k, v in get_processing_kwargs(kwargs).items() if k not in OUTPUT_KWARGS and k != 'database'}
+    return hashlib.sha1(f'{table} {version} {config}'.encode()).hexdigest()
+
+
+def get_log_dependencies(log, row, table, database):
+    '''
+    Returns what the cached LOG depends on: its data file, its database ROW, and any other rows read while processing
+    it. Other changes to the database leave it valid.
+    '''
+    row_dependency = get_row_dependency(f'SELECT * FROM {table} WHERE ID={row["ID"]};', database, [row])
+    return [log.path, row_dependency, *getattr(log, 'db_dependencies', list())]
+
+
+def get_log_cache_key(ID, table, kwargs):
+    return f'LOG: {table} {ID}, VERSION: {version}, KWARGS: {get_processing_kwargs(kwargs)}'
+
+
+def get_row_stamp(row, table, data_dir, kwargs, dependencies):
+    '''
+    Returns a hash identifying the version of a processed log: it changes when the processing configuration, the log's
+    database row, its data file, or any of the other database rows it was processed with (its DEPENDENCIES, see
+    get_log_dependencies) change. Used to tell whether a client's copy of a log is still current.
+    '''
+    try:
+        mtime = os.path.getmtime(os.path.join(data_dir, row['PATH']))
+    except (KeyError, OSError):
+        mtime = None
+    config = {k: v for k, v in get_processing_kwargs(kwargs).items() if k != 'database'}
+    rows = sorted((dep['query'], dep['hash']) for dep in dependencies if isinstance(dep, dict))
+    return hashlib.sha1(f'{table} {version} {config} {sorted(dict(row).items())} {mtime} {rows}'.encode()).hexdigest()
+
+
+def get_cached_dependencies(row, table, database, kwargs):
+    '''Returns the dependencies of the cached log of ROW, or None if it isn't cached (or is no longer valid).'''
+    cache = Cache()
+    key = get_log_cache_key(row['ID'], table, dict(kwargs, database=database))
+    try:
+        obj_data = cache.index[key]
+    except KeyError:
+        return None
+    if obj_data.is_invalid():
+        return None
+    return obj_data.depends_on
+
+
+def iter_processed(jobs, processes, pb, ordered=False, window=None, idle=None, timings=None):
+    '''
+    Process logs over the session's pool of PROCESSES worker processes, yielding (index, log) pairs as they become
+    available. JOBS is a list of (index, (args, kwargs)) pairs, submitted in that order one at a time. At most WINDOW
+    logs (default: twice the number of processes) are submitted to the pool and not yet yielded at any one time, so
+    memory use is bounded by the number of logs in flight. If ORDERED, logs are yielded in the order of JOBS, otherwise
+    in order of completion. Items from the iterable IDLE are yielded while waiting on the workers. The time taken to
+    process each log is stored in the dict TIMINGS, if given.
+    '''
+
+    if timings is None:
+        timings = dict()
+
+    idle = iter(idle) if idle is not None else iter(())
+
+    if processes == 1 or not jobs:
+        yield from idle
+        if jobs:
+            warning('Only using one core: this could take a while.')
+        for i, (args, kwargs) in jobs:
+            i, r, timings[i] = async_get_indexed((i, (None, args, kwargs)))
+            pb.update()
+            yield i, r
+        return
+
+    if window is None:
+        window = processes*2
+
+    pool, q = get_pool(processes)
+    set_progress_bar(pb)
+
+    done = Queue()
+    order = [i for i, __ in jobs]
+    pending = iter(jobs)
+    buffer = dict()
+    outstanding = 0
+
+    def submit():
+        nonlocal outstanding
         try:
-            pl = q.get(timeout=10)
-        except Empty:
-            time.sleep(0.1)
+            i, (args, kwargs) = next(pending)
+        except StopIteration:
+            return
+        pool.apply_async(async_get_indexed, ((i, (q, args, kwargs)),), callback=done.put, error_callback=done.put)
+        outstanding += 1
+
+    for __ in range(window):
+        submit()
+
+    pos = 0
+    while outstanding:
+        if idle is not None:
+            try:
+                r = done.get_nowait()
+            except Empty:
+                try:
+                    yield next(idle)
+                except StopIteration:
+                    idle = None
+                continue
+        else:
+            r = done.get()
+
+        if isinstance(r, BaseException):
+            raise r
+        pb.update()
+        i, log, timings[i] = r
+        log = unpack_log(log)
+        if not ordered:
+            outstanding -= 1
+            submit()
+            yield i, log
             continue
-        if isinstance(pl, int):
-            break
-        args, kwargs = pl
-        pb.print(*args, **kwargs)
+
+        buffer[i] = log
+        while pos < len(order) and order[pos] in buffer:
+            outstanding -= 1
+            submit()
+            yield order[pos], buffer.pop(order[pos])
+            pos += 1
+
+    if idle is not None:
+        yield from idle
+
+
+def load_or_process_log(row, table, database, **kwargs):
+    '''
+    Load the log for database row ROW from the cache, or process it in this process (and cache it) if not there.
+    '''
+    cache = Cache()
+    key = get_log_cache_key(row['ID'], table, dict(kwargs, database=database))
+    # load_object validates the cached log, returning None if it is no longer valid
+    log = cache.load_object(key) if key in cache.index else None
+    if log is None:
+        log = async_get((None, (dict(row), get_data_dir(database)), dict(kwargs, table=table)))
+        if log is not None:
+            depends_on = get_log_dependencies(log, row, table, database)
+            cache.save_object(key, log, depends_on, fmt=LOG_CACHE_FORMAT)
+            save_summary(database, get_config_hash(table, kwargs), log, depends_on)
+    return log
+
+
+def get_lazy(query, *, database='../data/.database.db', **kwargs):
+    database = os.path.expanduser(database)
+    table = get_table(query)
+    results = execute_sql(query, database)
+
+    if not results:
+        raise QueryError(f"No results returned by query \"{query}\"")
+
+    return [LazyLog(row, table, database, **kwargs) for row in results]
+
+
+# logs being processed by a query in this process, {cache key: Event set once the log is cached}. Other queries wanting
+# the same logs (e.g. procserver clients running the same script at once) wait for them instead of processing them again.
+__processing = dict()
+__processing_lock = threading.Lock()
+
+
+def claim_log(key):
+    '''Returns None if the caller is to process the log with cache KEY, or an Event to wait on if it is already being.'''
+    with __processing_lock:
+        event = __processing.get(key)
+        if event is not None:
+            return event
+        __processing[key] = threading.Event()
+        return None
+
+
+def release_log(key):
+    with __processing_lock:
+        event = __processing.pop(key, None)
+    if event is not None:
+        event.set()
+
+
+def iter_rows(results, table, database, ordered=False, max_processes=20, **kwargs):
+    '''
+    Yields (index, log) pairs for the database rows RESULTS. Logs already in the cache are loaded from there, the rest
+    are sent to the worker pool and each is written to the cache as it arrives. If ORDERED, logs are yielded in the
+    order of RESULTS (using a small reorder buffer), otherwise in order of completion.
+    '''
+    cache = Cache()
+    data_dir = get_data_dir(database)
+    config = get_config_hash(table, kwargs)
+    keys = [get_log_cache_key(row['ID'], table, dict(kwargs, database=database)) for row in results]
+    jobs, waiting = list(), dict()
+    for i, (row, key) in enumerate(zip(results, keys)):
+        if cache.is_cached(key):
+            continue
+        if (event := claim_log(key)) is not None:
+            waiting[i] = event
+        elif key in cache.index:
+            # cached by another query since checked
+            release_log(key)
+        else:
+            jobs.append((i, ((dict(row), data_dir), dict(kwargs, table=table))))
+    to_process = {i for i, __ in jobs}
+
+    if n_cached := len(results) - len(jobs) - len(waiting):
+        timestamp(f'Loading {n_cached} logs from cache.')
+    if waiting:
+        timestamp(f'Waiting on {len(waiting)} logs being processed by another query.')
+
+    processes = get_max_processes(max_processes)
+    if jobs:
+        timestamp(f'Processing {len(jobs)} logs over {processes} processes.')
+    pb = ProgressBar(len(jobs))
+
+    timings = dict()
+    if not ordered:
+        # start the most expensive logs first, so that a large log doesn't hold up the end of the query
+        costs = estimate_costs([row for __, ((row, __), __) in jobs], data_dir, table)
+        jobs = [job for __, job in sorted(zip(costs, jobs), key=lambda cj: cj[0], reverse=True)]
+
+    def save(i, log):
+        if log is not None:
+            depends_on = get_log_dependencies(log, results[i], table, database)
+            cache.save_object(keys[i], log, depends_on, fmt=LOG_CACHE_FORMAT)
+            save_summary(database, config, log, depends_on)
+        release_log(keys[i])
+
+    def load_cached(i):
+        if i in waiting:
+            waiting[i].wait()
+        # if invalidated since checked (or the other query failed to process it), this processes the log in this
+        # process instead
+        return i, load_or_process_log(results[i], table, database, **kwargs)
+
+    try:
+        if ordered:
+            processed = iter_processed(jobs, processes, pb, ordered=True, timings=timings)
+            for i in range(len(results)):
+                if i in to_process:
+                    i, log = next(processed)
+                    save(i, log)
+                else:
+                    i, log = load_cached(i)
+                if log is not None:
+                    yield i, log
+        else:
+            cached = (load_cached(i) for i in range(len(results)) if i not in to_process and i not in waiting)
+            for i, log in iter_processed(jobs, processes, pb, idle=cached, timings=timings):
+                if i in to_process:
+                    save(i, log)
+                if log is not None:
+                    yield i, log
+            # left until last, so as not to hold up this query's own logs
+            for i in waiting:
+                i, log = load_cached(i)
+                if log is not None:
+                    yield i, log
+    finally:
+        for i in to_process:
+            release_log(keys[i])
+        record_timings({get_timing_key(results[i], table): (dt, get_size(results[i], data_dir))
+                        for i, dt in timings.items()})
+
+
+def iter_query(query, *, database='../data/.database.db', ordered=False, max_results=500, max_processes=20,
+               ignore_exceptions=False, **kwargs):
+    '''
+    Generator version of query_db: yields each log as soon as it is available, rather than waiting for the whole query
+    to be processed. If ORDERED, logs are yielded in the order returned by the database, otherwise in order of
+    completion.
+    '''
+    database = os.path.expanduser(database)
+    table = get_table(query)
+    results = execute_sql(query, database)
+    kwargs['ignore_exceptions'] = ignore_exceptions
+
+    if not results:
+        raise QueryError(f"No results returned by query \"{query}\"")
+
+    check_n_results(len(results), max_results)
+
+    for __, log in iter_rows(results, table, database, ordered=ordered, max_processes=max_processes, **kwargs):
+        yield log
+
+def iter_query_synced(query, *, have, database='../data/.database.db', ordered=False, max_results=500,
+                      max_processes=20, ignore_exceptions=False, **kwargs):
+    '''
+    Like iter_query, but yields (index, ID, stamp, log) for each log, INDEX being its position in the query's results.
+    Logs in HAVE ({ID: stamp}, e.g. those a client already holds) whose stamp is still current are not processed or
+    loaded at all: log is None for these.
+    '''
+    database = os.path.expanduser(database)
+    table = get_table(query)
+    results = execute_sql(query, database)
+    kwargs['ignore_exceptions'] = ignore_exceptions
+
+    if not results:
+        raise QueryError(f"No results returned by query \"{query}\"")
+
+    data_dir = get_data_dir(database)
+    stamp_kwargs = dict(kwargs, database=database)
+
+    def get_stamp(i, dependencies):
+        return get_row_stamp(results[i], table, data_dir, stamp_kwargs, dependencies)
+
+    # a log can only be held if it is cached here: what else it depends on is only known once it is processed
+    dependencies = [get_cached_dependencies(row, table, database, kwargs) for row in results]
+    stamps = [get_stamp(i, deps) if deps is not None else None for i, deps in enumerate(dependencies)]
+    held = [i for i, (row, stamp) in enumerate(zip(results, stamps))
+            if stamp is not None and have.get(row['ID']) == stamp]
+    missing = sorted(set(range(len(results))) - set(held))
+    timestamp(f'{len(held)} of {len(results)} logs already held by client.')
+
+    check_n_results(len(missing), max_results)
+
+    def held_entry(i):
+        return i, results[i]['ID'], stamps[i], None
+
+    def sent_entry(i, log):
+        return i, log.ID, get_stamp(i, get_log_dependencies(log, results[i], table, database)), log
+
+    logs = iter_rows([results[i] for i in missing], table, database, ordered=ordered, max_processes=max_processes,
+                     **kwargs)
+    if not ordered:
+        yield from (held_entry(i) for i in held)
+        for j, log in logs:
+            yield sent_entry(missing[j], log)
+        return
+
+    held = iter(held)
+    next_held = next(held, None)
+    for j, log in logs:
+        i = missing[j]
+        while next_held is not None and next_held < i:
+            yield held_entry(next_held)
+            next_held = next(held, None)
+        yield sent_entry(i, log)
+    if next_held is not None:
+        yield held_entry(next_held)
+        yield from (held_entry(i) for i in held)
 
 # This whole section is a bit of a mess! TODO: tidy up
 
 def get_from_local(query, *, database='../data/.database.db', process_results=True, max_results=500, max_processes=20,
                    ignore_exceptions=False, plain_collection=True, **kwargs):
     database = os.path.expanduser(database)
+    table = get_table(query)
     results = execute_sql(query, database)
     kwargs['ignore_exceptions'] = ignore_exceptions
 
@@ -138,114 +538,159 @@ def get_from_local(query, *, database='../data/.database.db', process_results=Tr
     if not process_results:
         return [dict(result) for result in results]
 
-    if (lr := len(results)) > max_results and get_hostname() != 'Poseidona':
-        raise TooManyResultsError(f"Jeez, that's a lot of data! ({lr} > {max_results}, set 'max_results' to override.)")
+    check_n_results(len(results), max_results)
 
-    types = list({GuessLogType(row, table) for row in results})
+    processed_results = dict(iter_rows(results, table, database, max_processes=max_processes, **kwargs))
 
-    rv = list()
+    timestamp('Sorting')
+    rv = [processed_results[i] for i in sorted(processed_results)]
 
-    pb = ProgressBar(len(results))
+    if plain_collection:
+        return rv
+    return combine_logs(rv, **kwargs)
 
-    processed_results = dict()
-    order = [r['ID'] for r in results]
 
-    processes = get_n_processes()
-    if '--max-proc' in sys.argv:
-        max_processes = int(sys.argv[sys.argv.index('--max-proc')+1])
-    processes = min([processes, max_processes])
+def combine_logs(logs, **kwargs):
+    '''Returns LOGS, which must all be of the one type, collected into a CombinedLogs.'''
+    if len({type(log) for log in logs}) > 1:
+        raise GenericRheoprocException('multiple log types not destined for plain collection')
+    rv = CombinedLogs(**kwargs)
+    for log in logs:
+        rv.append(log)
+    return rv
 
-    timestamp(f'processing {len(results)} logs over {processes} processes.')
 
-    data_dir = '/'.join(database.split('/')[:-1])
+def get_from_summary(query, *, database='../data/.database.db', fields, max_results=500, **kwargs):
+    '''
+    Get logs for a query which asks only for summary FIELDS (averages and deviations). Where these are in the summary
+    table, lazy logs holding them are returned without any processing; the remaining logs are processed as usual.
+    '''
+    database = os.path.expanduser(database)
+    table = get_table(query)
+    results = execute_sql(query, database)
 
-    if processes > 1:
-        mp.set_start_method('fork', True)
-        m = mp.Manager()
-        q = m.Queue()
-        printer_thread = threading.Thread(target=printer, args=(q,pb), daemon=True)
-        printer_thread.start()
-    else:
-        q = None
-    list_of_args_kwargs = [(q, (dict(res), data_dir), kwargs) for res in results]
-    if processes == 1:
-        warning('Only using one core: this could take a while.')
-        for a_kw in list_of_args_kwargs:
-            r = async_get(a_kw)
-            pb.update()
-            if r:
-                processed_results[r.ID] = r
-    else:
-        with mp.Pool(processes=processes) as pool:
-            for r in pool.imap_unordered(async_get, list_of_args_kwargs):
-                pb.update()
-                if r:
-                    processed_results[r.ID] = r
-    if processes > 1:
-        q.put(0)
-        printer_thread.join()
+    if not results:
+        raise QueryError(f"No results returned by query \"{query}\"")
 
-    timestamp('Sorting')
-    for ID in order:
-        try:
-            rv.append(processed_results[ID])
-        except Exception as e:
-            if ignore_exceptions:
-                pass
-            else:
-                warning(processed_results)
-                raise e
+    kwargs['fields'] = fields
+    config = get_config_hash(table, kwargs)
+    summaries = load_summaries(database, config, [row['ID'] for row in results], fields)
+    if summaries:
+        timestamp(f'Loaded summaries of {len(summaries)} logs.')
+
+    missing = [row for row in results if row['ID'] not in summaries]
+    processed = dict()
+    if missing:
+        check_n_results(len(missing), max_results)
+        for i, log in iter_rows(missing, table, database, **kwargs):
+            processed[missing[i]['ID']] = log
+            # logs loaded from the cache weren't summarised when they were processed, or their summary is stale
+            save_summary(database, config, log, get_log_dependencies(log, missing[i], table, database))
 
-    if plain_collection:
-        processed_results = rv
-    else:
-        if len(types) == 1:
-            processed_results = CombinedLogs(**kwargs)
-            for log in rv:
-                processed_results.append(log)
-        else:
-            raise GenericRheoprocException('multiple log types not destined for plain collection')
-    return processed_results
+    rv = list()
+    for row in results:
+        if row['ID'] in summaries:
+            log = LazyLog(row, table, database, **kwargs)
+            log.data.update(summaries[row['ID']])
+            rv.append(log)
+        elif row['ID'] in processed:
+            rv.append(processed[row['ID']])
+    return rv
 
 
-def query_db(query, *args, database='../data/.database.db', server=None, returns='data', **kwargs):
+def get_from_server_cached(query, *args, server, database, process_results=True, plain_collection=True, **kwargs):
+    '''
+    Get the logs of a query from the server. There's no cache of the query as a whole (on a client, which may have
+    neither the logs' files nor the database, there would be nothing to tell when it went stale): the server is always
+    asked, and only sends the logs which have changed since they were last received. Logs are sent as they are ready
+    and put back in the order of the query here, so the server is free to start on the largest first.
+    '''
+    if not process_results:
+        return get_rows_from_server(server, query, *args, database=database, **kwargs)
 
-    args = (query, *args)
-    kwargs['database'] = database
-    kwargs['returns'] = returns
+    logs = dict(iter_from_server_synced(query, *args, server=server, database=database, **kwargs))
+    rv = [logs[i] for i in sorted(logs)]
+    if plain_collection:
+        return rv
+    return combine_logs(rv, **kwargs)
 
-    if not query.startswith("SELECT * FROM"):
-        raise QueryError(f'SQL query to database must be in the form "SELECT * FROM <TABLE> [WHERE ...];"\n Troublesome query: {query}')
 
-    global table
-    table = query.replace(';', '').split(' ')[3]
+def get_remote_manifest_key(server):
+    return f'REMOTE MANIFEST: {server}'
 
-    if not table in ACCEPTED_TABLES:
-        raise QueryError(f'SQL queries can only be used to access data-containing tables in the database: \n Troublesome table: {table}')
 
-    cache_key = f'QUERY: {query}, KWARGS: {kwargs}'
+def iter_from_server_synced(query, *args, server, database, **kwargs):
+    '''
+    Yields (index, log) for each log of the query from the server, INDEX being its position in the query's results.
+    Logs already in the local cache (from any earlier query to the
+    server) are only re-sent if they have changed on the server; the rest are loaded locally. Logs which are sent are
+    saved to the local cache on arrival (under the same key as if they had been processed locally), and their stamps
+    recorded in the manifest for the server.
+    '''
+    table = get_table(query)
     cache = Cache()
-    obj = cache.load_object(cache_key)
-    if obj is not None:
-        try:
-            n = len(obj) # very unlikely, but may raise TypeError if obj is not Iterable.
-            timestamp(f'Loaded {n} logs from cache.')
-        except TypeError:
-            timestamp(f'Loaded {type(obj)} from cache.')
-        if returns == 'cache_path':
-            return cache.get_path_in_cache_of(cache_key)
-        else:
-            return obj
+    key_kwargs = dict(kwargs, database=database)
+
+    manifest_key = get_remote_manifest_key(server)
+    manifest = (cache.load_object(manifest_key) if manifest_key in cache.index else None) or dict()
+    have = {ID: stamp for key, (ID, stamp) in manifest.items()
+            if key == get_log_cache_key(ID, table, key_kwargs) and cache.is_cached(key)}
+
+    def save(ID, stamp, log):
+        key = get_log_cache_key(ID, table, key_kwargs)
+        # the log's files, or even the database, may not exist on this machine
+        depends_on = [path for path in [log.path, os.path.expanduser(database)] if os.path.exists(path)]
+        cache.save_object(key, log, depends_on, fmt=LOG_CACHE_FORMAT)
+        manifest[key] = (ID, stamp)
+
+    # {ID: index} of logs to be loaded locally but which have gone from the cache
+    lost = dict()
+    try:
+        for i, ID, stamp, log in iter_from_server(server, query, *args, database=database, have=have, **kwargs):
+            if log is None:
+                log = cache.load_object(get_log_cache_key(ID, table, key_kwargs))
+                if log is None:
+                    lost[ID] = i
+                    continue
+            else:
+                save(ID, stamp, log)
+            yield i, log
+
+        if lost:
+            # removed from the local cache since the request was sent: fetch again
+            warning(f'{len(lost)} logs missing from local cache: re-requesting.')
+            lost_query = f'SELECT * FROM {table} WHERE ID IN ({", ".join(str(ID) for ID in lost)});'
+            for __, ID, stamp, log in iter_from_server(server, lost_query, *args, database=database, **kwargs):
+                save(ID, stamp, log)
+                yield lost[ID], log
+    finally:
+        cache.save_object(manifest_key, manifest)
+
+
+def query_db(query, *args, database='../data/.database.db', server=None, returns='data', stream=False, lazy=False,
+             **kwargs):
+
+    get_table(query)
+
+    if returns != 'data':
+        raise ValueError(f'Unknown returns value \'{returns}\'. The only valid value is \'data\'.')
+
+    if lazy:
+        if server:
+            warning('Lazy logs are processed locally: ignoring server.')
+        return get_lazy(query, *args, database=database, **kwargs)
 
-    processed_results = get_from_local(*args, **kwargs) if not server else get_from_server(server, *args, **kwargs)
+    if stream:
+        if server:
+            logs = iter_from_server_synced(query, *args, server=server, database=database, **kwargs)
+            return (log for __, log in logs)
+        return iter_query(query, *args, database=database, **kwargs)
 
-    timestamp('Caching')
-    depends_on = [log.path for log in processed_results]
-    depends_on.append(database)
-    cache.save_object(cache_key, processed_results, depends_on)
+    if server:
+        return get_from_server_cached(query, *args, server=server, database=database, **kwargs)
 
-    if returns == 'data':
-        return processed_results
-    elif returns == 'cache_path':
-        return cache.get_path_in_cache_of(cache_key)
+    fields = kwargs.get('fields')
+    if fields and all(is_summary_field(field) for field in fields):
+        return get_from_summary(query, *args, database=database, **kwargs)
 
+    return get_from_local(query, *args, database=database, **kwargs)
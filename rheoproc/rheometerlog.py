@@ -19,7 +19,7 @@ from rheoproc.calibration import apply_calibration
 from rheoproc.viscosity import get_material_viscosity, get_cs_composition_material
 from rheoproc.optenc import OpticalEncoderLog
 from rheoproc.clean import clean_data
-from rheoproc.exception import GenericRheoprocException, FileTypeError, PathNotAFileError, TimeRationalError, NaNError
+from rheoproc.exception import GenericRheoprocException, FileTypeError, PathNotAFileError, TimeRationalError, NaNError, FieldError
 from rheoproc.genericlog import GenericLog
 from rheoproc.varproplog import Categories
 from rheoproc.videodata import VideoData
@@ -37,6 +37,49 @@ MAIN_LOG_RE = re.compile(r'^(logs/)?rpir_.*_.*\.csv$')
 VIDEO_RE = re.compile(r'^(logs/)?rpir_.*_.*_video\.(mp4|h264)$')
 PHOTO_RE = re.compile(r'^(logs/)?rpir_.*_.*_photo\.jpg$')
 RUNPARAMS_RE = re.compile(r'^(logs/)?rpir_.*_.*_runparams\.json$')
+STATS_RE = re.compile(r'_(av|std)$')
+
+# quantities produced by RheometerLog.process_data, and the quantities each is calculated from
+FIELD_DEPENDENCIES = {
+    'time': [],
+    'raw_time': [],
+    'adc': [],
+    'pnd': ['adc'],
+    'temperature': [],
+    'ambient_temperature': [],
+    'expected_viscosity': ['temperature'],
+    'photos': [],
+    'encoders': [],
+    'speed': ['encoders'],
+    'position': ['speed'],
+    'strainrate': ['speed'],
+    'strain': ['strainrate'],
+    'loadcell_raw_indices': [],
+    'loadcell': ['position'],
+    'load_torque': ['loadcell', 'speed'],
+    'stress': ['load_torque'],
+    'viscosity': ['stress', 'strainrate'],
+}
+
+
+def resolve_fields(fields=None):
+    '''
+    Returns the set of quantities which must be calculated to provide FIELDS (e.g. ['viscosity_av', 'temperature']).
+    If FIELDS is None, everything is calculated.
+    '''
+    if fields is None:
+        return set(FIELD_DEPENDENCIES)
+
+    needed = {'time', 'raw_time'}
+    to_resolve = [STATS_RE.sub('', field) for field in fields]
+    while to_resolve:
+        field = to_resolve.pop()
+        if field not in FIELD_DEPENDENCIES:
+            raise FieldError(f'Unknown field "{field}". Fields are: {", ".join(FIELD_DEPENDENCIES)}, and their _av and _std.')
+        if field not in needed:
+            needed.add(field)
+            to_resolve.extend(FIELD_DEPENDENCIES[field])
+    return needed
 
 
 class RheometerLog(GenericLog):
@@ -107,9 +150,12 @@ class RheometerLog(GenericLog):
             warning(f'[{self.ID}]', *args, **kwargs)
 
     def process_data(self, read_video=False, read_photo=False, clean=True, calc_speed=True,
-                     standard_wobble_method='any', **kwargs):
+                     standard_wobble_method='any', fields=None, **kwargs):
         self.timestamp('Processing RheometerLog')
 
+        # only calculate what is needed for the requested fields (everything, by default)
+        needed = resolve_fields(fields)
+
         encoders = list()
         photos = list()
         run_params = dict()
@@ -145,8 +191,9 @@ class RheometerLog(GenericLog):
 
             for member in tarlog.getmembers():
                 if OPTENC_LOG_RE.match(member.name):
-                    with tarlog.extractfile(member) as logfp:
-                        encoders.append(OpticalEncoderLog(logfp, self, **kwargs))
+                    if 'encoders' in needed:
+                        with tarlog.extractfile(member) as logfp:
+                            encoders.append(OpticalEncoderLog(logfp, self, **kwargs))
                 elif MAIN_LOG_RE.match(member.name):
                     with tarlog.extractfile(member) as logfp:
                         lines = [l.decode('utf-8') for l in logfp.readlines()]
@@ -164,7 +211,9 @@ class RheometerLog(GenericLog):
                     else:
                         self.warning(f"Log has video, but not reading it (arg 'read_video' is False).")
                 elif PHOTO_RE.match(member.name):
-                    if read_photo:
+                    if 'photos' not in needed:
+                        pass
+                    elif read_photo:
                         tarlog.extractall(path=f'/tmp', members=[member])
                         image = cv.imread(f'/tmp/{member.name}')
                         os.system(f'rm /tmp/{member.name}')
@@ -190,20 +239,30 @@ class RheometerLog(GenericLog):
             
         dat = np.array(dat)
 
+        # quantities not needed for the requested fields are left as None, and dropped below
+        adc = pnd = speed = position = strainrate = strain = None
+        lco_i = loadcell = load_torque = stress = viscosity = expected_viscosity = None
+
         raw_time = dat[0]
         time = np.subtract(raw_time, raw_time[0])
-        adc = np.array([convert_bit_to_volts(a, bit_length=12, max_voltage=3.3) for a in dat[1:9]])
+        self.samplerate = 1./np.average(np.diff(time))
 
-        pnd = np.array([], dtype=np.float64)
-        if self.hardware_version < HW_VER_PND_SPLIT and self.has_PND:
-            pnd = adc[1]
-            self.pnd_channels = 1
-        elif HW_VER_PND_SPLIT <= self.hardware_version:
-            pnd = pnd_recombine(adc[1], adc[2])
-            self.pnd_channels = 2
+        if 'adc' in needed:
+            adc = np.array([convert_bit_to_volts(a, bit_length=12, max_voltage=3.3) for a in dat[1:9]])
+
+        if 'pnd' in needed:
+            pnd = np.array([], dtype=np.float64)
+            if self.hardware_version < HW_VER_PND_SPLIT and self.has_PND:
+                pnd = adc[1]
+                self.pnd_channels = 1
+            elif HW_VER_PND_SPLIT <= self.hardware_version:
+                pnd = pnd_recombine(adc[1], adc[2])
+                self.pnd_channels = 2
 
         #ca = np.array(dat[9])
-        if 20200908 <= self.software_version <= 20200910:
+        if 'temperature' not in needed:
+            temperature = None
+        elif 20200908 <= self.software_version <= 20200910:
             self.warning(f'Logged using software ver {self.software_version} (between 20200908 and 20200910): fixing error in temp calc')
             broken_temp = dat[10]
             fixed_temp = np.zeros(len(broken_temp))
@@ -219,81 +278,96 @@ class RheometerLog(GenericLog):
             temperature = dat[10]
 
         try:
-            loadcell = dat[11]
+            raw_loadcell = dat[11]
         except IndexError:
             raise GenericRheoprocException("Log is TSTS log?") # TODO check and work around this
 
-        lco_v, lco_t, lco_i = rat_times(loadcell, time, list(range(len(time))))
-        self.stress_samplerate = 1./np.average(np.diff(lco_t))
-        self.samplerate = 1./np.average(np.diff(time))
-        self.recreated_loadcell = True
-        try:
-            loadcell = recreate(time, loadcell, loadcell, kind='linear')
-        except ValueError:
-            self.warning('loadcell can\'t be recreated: may be faulty!')
-            self.recreated_loadcell = False
-        except Exception as e:
-            #loadcell = recreate(time, loadcell, loadcell, kind='linear')
-            print(self.ID)
-            raise e
+        if 'loadcell' in needed or 'loadcell_raw_indices' in needed:
+            lco_v, lco_t, lco_i = rat_times(raw_loadcell, time, list(range(len(time))))
+            self.stress_samplerate = 1./np.average(np.diff(lco_t))
+
+        if 'loadcell' in needed:
+            self.recreated_loadcell = True
+            try:
+                loadcell = recreate(time, raw_loadcell, raw_loadcell, kind='linear')
+            except ValueError:
+                self.warning('loadcell can\'t be recreated: may be faulty!')
+                self.recreated_loadcell = False
+                loadcell = raw_loadcell
+            except Exception as e:
+                #loadcell = recreate(time, loadcell, loadcell, kind='linear')
+                print(self.ID)
+                raise e
 
         if len(dat) > 12:
             ambient_temperature = dat[12]
         else:
-            ambient_temperature = [np.nan for __ in temperature]
+            ambient_temperature = [np.nan for __ in time]
 
-        if not encoders:
-            raise GenericRheoprocException("No optical encoder logs")
+        if 'speed' in needed:
+            if not encoders:
+                raise GenericRheoprocException("No optical encoder logs")
 
-        speed = np.zeros(np.shape(raw_time))
+            speed = np.zeros(np.shape(raw_time))
 
-        if calc_speed:
-            for encoder in encoders:
-                encoder.calc_speed() # speed in ROT/S
-                speed = np.add(speed, encoder.speed_in_alt_time(raw_time))
-            speed = np.divide(speed, float(len(encoders)))
+            if calc_speed:
+                for encoder in encoders:
+                    encoder.calc_speed() # speed in ROT/S
+                    speed = np.add(speed, encoder.speed_in_alt_time(raw_time))
+                speed = np.divide(speed, float(len(encoders)))
 
-        if np.any(np.isnan(speed)):
-            raise NaNError('NaN speed')
+            if np.any(np.isnan(speed)):
+                raise NaNError('NaN speed')
 
-        if (lt := len(raw_time)) != (ls := len(speed)):
-            raise TimeRationalError(f'Time array and speed array must match lengths ({lt} != {ls}); something has gone wrong.')
+            if (lt := len(raw_time)) != (ls := len(speed)):
+                raise TimeRationalError(f'Time array and speed array must match lengths ({lt} != {ls}); something has gone wrong.')
 
         RIN = self.geometry['RIN']
         ROUT = self.geometry['ROUT']
-        # speed in rot/s, multiply by circumference to get m/s
-        speed_ms = np.multiply(speed, 2.0*np.pi*RIN) # m/s
-
-        gap = ROUT - RIN
-        strainrate = np.divide(speed_ms, gap) # inverse seconds
-        # strainrate is calculated in inverse seconds (C/G/s) where C is circumference in m and G is gap size in m
-
-        strain = list()
         dt = np.diff(time)
-        strain.append(np.average(dt) * strainrate[0])
-        for dti, gdi in zip(dt, strainrate[1:]):
-            strain.append(dti*gdi + strain[-1])
-        # strain is in C/Gs - unitless!
-
-        position = list()
-        position.append(np.average(dt) * speed[0]) # speed in rot/s
-        for dti, spi in zip(dt, speed[1:]):
-            position.append(dti*spi + position[-1])
-        # position in rotations
-
-        try:
-            loadcell = remove_standard_wobble(position, loadcell, self.motor, standard_wobble_method)
-        except GenericRheoprocException:
-            warning(f'Error removing wobbling in log {self.ID}')
-            raise
-        # LC value seems to be hovering around 2**31, halfway up a 32-bit integer. Somewhere I've made a mistake
-        # converting an unsigned int.
-
-        load_torque = apply_calibration(loadcell, speed, self.override_calibration, self.date)
-        stress = ns.divide(load_torque, 2.0*np.pi*RIN*RIN*(0.001*self.fill_depth))
 
-        viscosity = ns.divide(stress, strainrate)
-        expected_viscosity = get_material_viscosity(self.material, np.array(temperature, dtype=np.float64))
+        if 'strainrate' in needed:
+            # speed in rot/s, multiply by circumference to get m/s
+            speed_ms = np.multiply(speed, 2.0*np.pi*RIN) # m/s
+
+            gap = ROUT - RIN
+            strainrate = np.divide(speed_ms, gap) # inverse seconds
+            # strainrate is calculated in inverse seconds (C/G/s) where C is circumference in m and G is gap size in m
+
+        if 'strain' in needed:
+            strain = list()
+            strain.append(np.average(dt) * strainrate[0])
+            for dti, gdi in zip(dt, strainrate[1:]):
+                strain.append(dti*gdi + strain[-1])
+            # strain is in C/Gs - unitless!
+
+        if 'position' in needed:
+            position = list()
+            position.append(np.average(dt) * speed[0]) # speed in rot/s
+            for dti, spi in zip(dt, speed[1:]):
+                position.append(dti*spi + position[-1])
+            # position in rotations
+
+        if 'loadcell' in needed:
+            try:
+                loadcell = remove_standard_wobble(position, loadcell, self.motor, standard_wobble_method)
+            except GenericRheoprocException:
+                warning(f'Error removing wobbling in log {self.ID}')
+                raise
+            # LC value seems to be hovering around 2**31, halfway up a 32-bit integer. Somewhere I've made a mistake
+            # converting an unsigned int.
+
+        if 'load_torque' in needed:
+            load_torque = apply_calibration(loadcell, speed, self.override_calibration, self.date)
+
+        if 'stress' in needed:
+            stress = ns.divide(load_torque, 2.0*np.pi*RIN*RIN*(0.001*self.fill_depth))
+
+        if 'viscosity' in needed:
+            viscosity = ns.divide(stress, strainrate)
+
+        if 'expected_viscosity' in needed:
+            expected_viscosity = get_material_viscosity(self.material, np.array(temperature, dtype=np.float64))
         self.timestamp('Processing complete')
 
         data = {
@@ -327,6 +401,11 @@ class RheometerLog(GenericLog):
             }
         }
 
+        for category, cat_data in list(data.items()):
+            for name in list(cat_data):
+                if name not in needed:
+                    del cat_data[name]
+
         for category, cat_data in list(data.items()):
             for name, (value, stats) in list(cat_data.items()):
                 if stats in ['average', 'both']:
@@ -337,7 +416,7 @@ class RheometerLog(GenericLog):
         return data
 
 
-    def set_data(self, data, categories=Categories.ALL, averages_only=False, **kwargs):
+    def set_data(self, data, categories=Categories.ALL, averages_only=False, fields=None, **kwargs):
 
         self.cat = categories
 
@@ -364,6 +443,8 @@ class RheometerLog(GenericLog):
         for category, cat_data in data.items():
             if category in categories or category == 'required':
                 for name, (value, stats) in cat_data.items():
+                    if fields is not None and name not in fields and category != 'required':
+                        continue
                     if averages_only:
                         if not (name.endswith('_av') or name.endswith('_std') or category == 'required'):
                             continue
@@ -0,0 +1,76 @@
+# rheoproc.schedule
+# Estimates how long each log will take to process, so that jobs can be handed to the worker pool most expensive
+# first (a single huge log started last would otherwise leave the other workers idle). Estimates come from the time
+# taken to process the log previously if known, otherwise from the size of its archive.
+
+import os
+import json
+import threading
+
+from rheoproc.cache import CACHE_DIR, Cache
+from rheoproc.error import warning
+
+
+TIMINGS_PATH = f'{CACHE_DIR}/timings.json'
+
+
+def get_timing_key(row, table):
+    return f'{table} {row["ID"]}'
+
+
+def get_size(row, data_dir):
+    try:
+        return os.path.getsize(os.path.join(data_dir, row['PATH']))
+    except (KeyError, OSError):
+        return 0
+
+
+def load_timings() -> dict:
+    if not os.path.isfile(TIMINGS_PATH):
+        return dict()
+
+    try:
+        with open(TIMINGS_PATH) as f:
+            return json.load(f)
+    except Exception as e:
+        warning(f'Could not read log timings: {e}')
+        return dict()
+
+
+def record_timings(timings: dict):
+    '''
+    Add TIMINGS, a dict of {key: (seconds, size)}, to the record of how long logs took to process.
+    '''
+    if not timings:
+        return
+    # other threads and processes record timings too: the update is made under the cache's lock, and the file
+    # replaced whole so that readers never see it part written
+    cache = Cache()
+    tmp_path = f'{TIMINGS_PATH}.tmp-{os.getpid()}-{threading.get_ident()}'
+    with cache.lock():
+        all_timings = load_timings()
+        all_timings.update(timings)
+        with open(tmp_path, 'w') as f:
+            json.dump(all_timings, f)
+        os.replace(tmp_path, TIMINGS_PATH)
+
+
+def estimate_costs(rows, data_dir, table):
+    '''
+    Returns the estimated processing time of each of ROWS. Logs which have not been timed before are estimated from
+    their size, using the average processing rate (seconds per byte) of those which have.
+    '''
+    timings = load_timings()
+
+    total_seconds = sum(seconds for seconds, size in timings.values() if size)
+    total_size = sum(size for seconds, size in timings.values() if size)
+    rate = total_seconds / total_size if total_size else 1.0
+
+    costs = list()
+    for row in rows:
+        key = get_timing_key(row, table)
+        if key in timings:
+            costs.append(timings[key][0])
+        else:
+            costs.append(get_size(row, data_dir)*rate)
+    return costs
@@ -1,100 +1,113 @@
 # rheoproc.server
 # remote processing server - class is created and run when rheoproc module is called as a program: 'python -m rheoproc'
 
-import os
 import socket
-import pickle
-import json
-from zlib import compress, decompress
-import time
+import threading
 
 
 from rheoproc.port import PORT
-from rheoproc.query import query_db
+from rheoproc.protocol import Connection
+from rheoproc.query import get_from_local, iter_query_synced, get_max_processes
+from rheoproc.pool import get_pool
 from rheoproc.error import timestamp, warning
 
-def fmt_time(t : int):
-    if t > 60:
-        return f'{t//60}m {t%60}s'
-    return f'{t}s'
-
 
 
 class Server:
+    '''
+    Answers queries from clients (rheoproc.client.iter_from_server). Each connection is handled in its own thread, with
+    all queries sharing the one worker pool. At most MAX_JOBS queries are run at once; clients beyond that wait (and are
+    told they are waiting) for a free slot. Logs wanted by several queries at once are processed once (see
+    rheoproc.query.iter_rows).
+    '''
 
 
-    def __init__(self):
+    def __init__(self, max_jobs=2, max_processes=20):
         self.running = False
-        timestamp('Procserver started')
-        self.conn = None
-        self.addr = None
+        self.max_processes = max_processes
+        self.jobs = threading.BoundedSemaphore(max_jobs)
+        # start the workers now, before there are other threads about which might be holding locks when forking
+        get_pool(get_max_processes(max_processes))
+        timestamp(f'Procserver started (max {max_jobs} concurrent jobs, {max_processes} processes)')
 
 
     def run(self):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
             s.bind(('', PORT))
             s.listen()
             timestamp(f'Listening on {PORT}')
             self.running = True
             while self.running:
                 try:
-                    self.conn, self.addr = s.accept()
-                    self.handle_connection()
-                    self.conn.close()
-                    self.conn = None
+                    sock, addr = s.accept()
+                    thread = threading.Thread(target=self.serve_client, args=(sock, addr), daemon=True)
+                    thread.start()
                 except KeyboardInterrupt:
                     break
-                except Exception:
-                    pass
+                except Exception as e:
+                    warning(f'Error accepting connection: {e}')
 
 
+    def serve_client(self, sock, addr):
+        with sock:
+            conn = Connection(sock)
+            try:
+                self.handle_connection(conn, addr)
+            except Exception as e:
+                warning(f'[{addr[0]}:{addr[1]}] Connection lost: {e}')
+            finally:
+                conn.close()
 
-    def handle_connection(self):
-        # Get query information
-        data = self.conn.recv(4096)
-        args, kwargs = pickle.loads(data)
 
-        self.status('Querying database.')
+    def handle_connection(self, conn, addr):
+        # Get query information, and the logs the client already has, {ID: stamp}
+        m_type, (args, kwargs, have) = conn.recv_message()
+        # all jobs share the pool, so must agree on its size
+        kwargs['max_processes'] = self.max_processes
 
-        kwargs['returns'] = 'cache_path'
-        try:
-            cache_path = query_db(*args, **kwargs)
-            self.status('Preparing result.')
-            with open(cache_path, 'rb') as f:
-                data = f.read()
-
-            self.status('Compressing...')
-            orig_size = len(data)
-            before = time.time()
-            data = compress(data, 1)
-            after = time.time()
-            dt = int(after - before)
-            self.status(f'Compressed to {len(data)*100//orig_size}% in {fmt_time(dt)}')
-
-            self.status('Sending result')
-            self.send_message(m_type='preamble', size=len(data))
-            self.conn.sendall(data)
+        def status(status_msg):
+            timestamp(f'[{addr[0]}:{addr[1]}]', status_msg)
+            conn.send_message('status', status_msg)
 
+        try:
+            if not self.jobs.acquire(blocking=False):
+                status('Server busy: waiting for other queries to finish.')
+                self.jobs.acquire()
+            try:
+                status('Querying database.')
+                if kwargs.get('process_results', True):
+                    self.stream_query(conn, addr, args, kwargs, have)
+                else:
+                    # just the database rows
+                    conn.send_message('result', get_from_local(*args, **kwargs), codec='pickle')
+            finally:
+                self.jobs.release()
         except Exception as e:
             # if something goes wrong, send exception back to client
-            warning(f'An error occurred: {e}')
-            self.send_message(m_type='exception', exception=str(e))
-
-
-    def send_message(self, *, m_type, **kwargs):
-        data = {
-            'type':m_type,
-            **kwargs
-        }
-        data = json.dumps(data).encode()
-        self.conn.sendall(data)
-
-
-    def status(self, status_msg):
-        timestamp(status_msg)
-        self.send_message(m_type='status', status=status_msg)
+            warning(f'[{addr[0]}:{addr[1]}] An error occurred: {e}')
+            conn.send_message('exception', str(e))
+
+
+    def stream_query(self, conn, addr, args, kwargs, have):
+        '''
+        Send each log of the query to the client as soon as it has been processed (or loaded from the cache), with its
+        index in the query's results so the client can put them back in order. Logs the client already has an up to
+        date copy of (from HAVE, {ID: stamp}) are not sent, only noted as held.
+        '''
+        # logs are sent in the columnar wire format, optionally with arrays downcast to float32
+        log_codec = 'wire-float32' if kwargs.pop('wire_float32', False) else 'wire'
+        n_sent, n_held = 0, 0
+        for i, ID, stamp, log in iter_query_synced(*args, have=have, **kwargs):
+            if log is None:
+                conn.send_message('held', [ID, stamp, i])
+                n_held += 1
+            else:
+                conn.send_message('log', (stamp, log, i), codec=log_codec)
+                n_sent += 1
+        conn.send_frame('end', b'')
+        timestamp(f'[{addr[0]}:{addr[1]}] Sent {n_sent} logs ({n_held} already held by client).')
 
 
     def stop(self):
         self.running = False
-
@@ -2,7 +2,64 @@
 # light wrapper around the sqlite3 builtin module - tidies the API into a single function call.
 
 import os
+import hashlib
 import sqlite3
+import threading
+
+from rheoproc.tags import resolve_tag_conditions
+
+# rows read by execute_sql are recorded here (per thread) while tracking, see track_dependencies
+__tracking = threading.local()
+# hashes of query results, with the (mtime, size) of the database they were taken from
+__row_hashes = dict()
+
+
+def hash_rows(rows):
+    h = hashlib.sha1()
+    for row in rows:
+        for key in row.keys():
+            h.update(repr((key, row[key])).encode())
+    return h.hexdigest()
+
+
+def get_row_dependency(query, database, rows=None):
+    '''
+    Returns a dependency (for a cache object's depends_on) on the result of QUERY: the object is invalidated if the
+    rows returned change. ROWS, if given, is the result already got.
+    '''
+    if rows is None:
+        rows = execute_sql(query, database)
+    return {'database': os.path.abspath(database), 'query': query, 'hash': hash_rows(rows)}
+
+
+def get_current_row_hash(query, database):
+    '''Returns the hash of the rows QUERY currently returns (re-running it only if the database has changed).'''
+    st = os.stat(database)
+    stamp = (st.st_mtime_ns, st.st_size)
+    cached = __row_hashes.get((database, query))
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    conn = sqlite3.connect(database)
+    try:
+        conn.row_factory = sqlite3.Row
+        rv = hash_rows(conn.execute(query).fetchall())
+    finally:
+        conn.close()
+    __row_hashes[(database, query)] = (stamp, rv)
+    return rv
+
+
+def track_dependencies():
+    '''Start recording the results of queries made (in this thread) through execute_sql.'''
+    __tracking.dependencies = dict()
+
+
+def get_tracked_dependencies():
+    '''Stop recording and return a dependency on each query made since track_dependencies was called.'''
+    dependencies = getattr(__tracking, 'dependencies', None) or dict()
+    __tracking.dependencies = None
+    return list(dependencies.values())
+
 
 def execute_sql(query, database):
 
@@ -14,12 +71,18 @@ def execute_sql(query, database):
     try:
         conn.row_factory = sqlite3.Row
         cur = conn.cursor()
-        cur.execute(query)
+        # tag conditions are decided on here, by the database the query is actually run on
+        cur.execute(resolve_tag_conditions(query, database))
         results = cur.fetchall()
         conn.close()
     finally:
         if conn:
             conn.close()
+
+    dependencies = getattr(__tracking, 'dependencies', None)
+    if dependencies is not None:
+        dependency = get_row_dependency(query, database, results)
+        dependencies[(dependency['database'], query)] = dependency
     return results
 
 
@@ -0,0 +1,168 @@
+# rheoproc.summary
+# Keeps the scalar summaries (averages and standard deviations) of processed logs in an SQLite table, filled in as logs
+# are processed. Queries which only ask for these can then be answered straight from SQL, without processing or
+# unpickling any logs. The table lives in '.summary.db' next to the database, keeping derived data out of the
+# database itself.
+
+import os
+import re
+import json
+import time
+import sqlite3
+
+import numpy as np
+
+from rheoproc.sql import execute_sql, get_current_row_hash
+from rheoproc.error import timestamp, warning
+
+
+SUMMARY_RE = re.compile(r'^.+_(av|std)$')
+
+
+def is_summary_field(name):
+    return bool(SUMMARY_RE.match(name))
+
+
+def get_summary_database(database):
+    return os.path.join(os.path.dirname(database), '.summary.db')
+
+
+def connect(database):
+    conn = sqlite3.connect(get_summary_database(database), timeout=60)
+    try:
+        conn.execute('CREATE TABLE IF NOT EXISTS SUMMARY (LOG_ID INTEGER, CONFIG TEXT, NAME TEXT, VALUE REAL, '
+                     'PRIMARY KEY (LOG_ID, CONFIG, NAME));')
+        # what each log's summary was made from (see rheoproc.query.get_log_dependencies), and when
+        conn.execute('CREATE TABLE IF NOT EXISTS SUMMARY_DEPENDENCIES (LOG_ID INTEGER, CONFIG TEXT, SAVED REAL, '
+                     'DEPENDS_ON TEXT, PRIMARY KEY (LOG_ID, CONFIG));')
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def is_current(depends_on, saved):
+    '''Whether a summary SAVED (at that time) from DEPENDS_ON is still current: none of its files or rows has changed.'''
+    for dep in depends_on:
+        if isinstance(dep, dict):
+            if not os.path.isfile(dep['database']):
+                return False
+            if get_current_row_hash(dep['query'], dep['database']) != dep['hash']:
+                return False
+        elif not os.path.exists(dep) or os.path.getmtime(dep) > saved:
+            return False
+    return True
+
+
+def get_current_IDs(conn, config, IDs=None):
+    '''Returns the IDs (of IDs, or of all logs) with a summary for CONFIG which is still current.'''
+    rv = set()
+    for ID, saved, depends_on in conn.execute('SELECT LOG_ID, SAVED, DEPENDS_ON FROM SUMMARY_DEPENDENCIES '
+                                              'WHERE CONFIG=?;', (config,)):
+        if (IDs is None or ID in IDs) and is_current(json.loads(depends_on), saved):
+            rv.add(ID)
+    return rv
+
+
+def get_summary_values(log):
+    rv = dict()
+    for name, value in getattr(log, 'data', dict()).items():
+        if not is_summary_field(name):
+            continue
+        try:
+            rv[name] = float(value)
+        except (TypeError, ValueError):
+            pass
+    return rv
+
+
+def save_summary(database, config, log, depends_on):
+    '''
+    Store the summary values of processed LOG, processed with the configuration hashed as CONFIG. DEPENDS_ON is what
+    the log was processed from (see rheoproc.query.get_log_dependencies): the summary is ignored once any of it changes.
+    '''
+    values = get_summary_values(log)
+    if not values:
+        return
+
+    try:
+        conn = connect(database)
+    except sqlite3.Error as e:
+        warning(f'Could not save summary of log {log.ID}: {e}')
+        return
+    try:
+        with conn:
+            conn.execute('DELETE FROM SUMMARY WHERE LOG_ID=? AND CONFIG=?;', (log.ID, config))
+            conn.executemany('INSERT INTO SUMMARY (LOG_ID, CONFIG, NAME, VALUE) VALUES (?, ?, ?, ?);',
+                             [(log.ID, config, name, value) for name, value in values.items()])
+            conn.execute('INSERT OR REPLACE INTO SUMMARY_DEPENDENCIES (LOG_ID, CONFIG, SAVED, DEPENDS_ON) '
+                         'VALUES (?, ?, ?, ?);', (log.ID, config, time.time(), json.dumps(depends_on)))
+    except sqlite3.Error as e:
+        warning(f'Could not save summary of log {log.ID}: {e}')
+    finally:
+        conn.close()
+
+
+def load_summaries(database, config, IDs, fields):
+    '''
+    Returns {ID: {field: value}} for each of IDs which has all of FIELDS stored for configuration CONFIG, and whose
+    summary is still current.
+    '''
+    rv = {ID: dict() for ID in IDs}
+    try:
+        conn = connect(database)
+    except sqlite3.Error as e:
+        warning(f'Could not read summaries: {e}')
+        return dict()
+    try:
+        current = get_current_IDs(conn, config, set(IDs))
+        fields_sql = ', '.join('?' for __ in fields)
+        cur = conn.execute(f'SELECT LOG_ID, NAME, VALUE FROM SUMMARY WHERE CONFIG=? AND NAME IN ({fields_sql});',
+                           (config, *fields))
+        for ID, name, value in cur:
+            if ID in rv and ID in current:
+                rv[ID][name] = np.nan if value is None else value
+    except sqlite3.Error as e:
+        warning(f'Could not read summaries: {e}')
+        return dict()
+    finally:
+        conn.close()
+    return {ID: values for ID, values in rv.items() if len(values) == len(set(fields))}
+
+
+def get_summarised_IDs(database, config):
+    try:
+        conn = connect(database)
+    except sqlite3.Error as e:
+        warning(f'Could not read summaries: {e}')
+        return set()
+    try:
+        return get_current_IDs(conn, config)
+    finally:
+        conn.close()
+
+
+def backfill_summaries(database='../data/.database.db', query='SELECT * FROM LOGS WHERE EXPERIMENT="RHEO";',
+                       max_processes=20, **kwargs):
+    '''
+    Process (in parallel) any logs returned by QUERY which don't yet have a summary stored for the processing
+    configuration given by KWARGS.
+    '''
+    from rheoproc.query import iter_rows, get_table, get_config_hash, get_log_dependencies
+
+    database = os.path.expanduser(database)
+    table = get_table(query)
+    config = get_config_hash(table, kwargs)
+    done = get_summarised_IDs(database, config)
+    rows = [row for row in execute_sql(query, database) if row['ID'] not in done]
+    timestamp(f'Backfilling summaries of {len(rows)} logs ({len(done)} already done).')
+    if not rows:
+        return
+
+    kwargs['averages_only'] = True
+    kwargs['ignore_exceptions'] = True
+    n = 0
+    for i, log in iter_rows(rows, table, database, max_processes=max_processes, **kwargs):
+        save_summary(database, config, log, get_log_dependencies(log, rows[i], table, database))
+        n += 1
+    timestamp(f'Backfilled summaries of {n} logs.')
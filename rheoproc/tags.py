@@ -0,0 +1,172 @@
+# rheoproc.tags
+# Maintains a normalised index of log tags, LOG_TAGS(LOG_ID, TAG), alongside the semicolon-separated TAGS column of
+# LOGS. Groups can then be found with an indexed lookup rather than a LIKE scan of every log. The index is built the
+# first time it is needed; after that, triggers on LOGS note which logs have changed (in LOG_TAGS_DIRTY) and those are
+# re-indexed before the next lookup. Tags match case-insensitively (for ASCII letters), as a LIKE on TAGS does.
+
+import os
+import re
+import json
+import sqlite3
+
+from rheoproc.error import timestamp, warning
+
+
+CREATE_SQL = [
+    'CREATE TABLE IF NOT EXISTS LOG_TAGS (LOG_ID INTEGER NOT NULL, TAG TEXT NOT NULL COLLATE NOCASE, '
+    'PRIMARY KEY (TAG, LOG_ID));',
+    'CREATE INDEX IF NOT EXISTS LOG_TAGS_BY_LOG ON LOG_TAGS (LOG_ID);',
+    'CREATE TABLE IF NOT EXISTS LOG_TAGS_DIRTY (LOG_ID INTEGER PRIMARY KEY);',
+    'CREATE TRIGGER IF NOT EXISTS LOG_TAGS_ON_INSERT AFTER INSERT ON LOGS BEGIN '
+    'INSERT OR IGNORE INTO LOG_TAGS_DIRTY (LOG_ID) VALUES (NEW.ID); END;',
+    'CREATE TRIGGER IF NOT EXISTS LOG_TAGS_ON_UPDATE AFTER UPDATE OF ID, TAGS ON LOGS BEGIN '
+    'INSERT OR IGNORE INTO LOG_TAGS_DIRTY (LOG_ID) VALUES (OLD.ID); '
+    'INSERT OR IGNORE INTO LOG_TAGS_DIRTY (LOG_ID) VALUES (NEW.ID); END;',
+    'CREATE TRIGGER IF NOT EXISTS LOG_TAGS_ON_DELETE AFTER DELETE ON LOGS BEGIN '
+    'INSERT OR IGNORE INTO LOG_TAGS_DIRTY (LOG_ID) VALUES (OLD.ID); END;',
+]
+
+
+def split_tags(tags):
+    if not tags:
+        return list()
+    return [tag for tag in tags.split(';') if tag]
+
+
+def index_logs(cur, IDs=None):
+    '''(Re-)index the tags of logs with the given IDs, or of all logs if IDs is None.'''
+    if IDs is None:
+        cur.execute('DELETE FROM LOG_TAGS;')
+        rows = cur.execute('SELECT ID, TAGS FROM LOGS;').fetchall()
+    else:
+        cur.executemany('DELETE FROM LOG_TAGS WHERE LOG_ID=?;', [(ID,) for ID in IDs])
+        rows = list()
+        for ID in IDs:
+            rows.extend(cur.execute('SELECT ID, TAGS FROM LOGS WHERE ID=?;', (ID,)).fetchall())
+
+    cur.executemany('INSERT OR IGNORE INTO LOG_TAGS (LOG_ID, TAG) VALUES (?, ?);',
+                    [(ID, tag) for ID, tags in rows for tag in split_tags(tags)])
+    if IDs is None:
+        cur.execute('DELETE FROM LOG_TAGS_DIRTY;')
+    else:
+        cur.executemany('DELETE FROM LOG_TAGS_DIRTY WHERE LOG_ID=?;', [(ID,) for ID in IDs])
+    return len(rows)
+
+
+def connect(database):
+    # never creates the database if it isn't there
+    return sqlite3.connect(f'file:{database}?mode=rw', uri=True, isolation_level=None)
+
+
+def rebuild_tag_index(database='../data/.database.db'):
+    '''Build (or re-build from scratch) the tag index from the TAGS column of LOGS.'''
+    database = os.path.expanduser(database)
+    conn = connect(database)
+    try:
+        # all or nothing: the tables are not left behind if (say) the triggers can't be made
+        conn.execute('BEGIN;')
+        try:
+            cur = conn.cursor()
+            # re-created rather than emptied, in case it was made by an older version (with case-sensitive tags)
+            cur.execute('DROP TABLE IF EXISTS LOG_TAGS;')
+            for sql in CREATE_SQL:
+                cur.execute(sql)
+            n = index_logs(cur)
+            conn.execute('COMMIT;')
+        except BaseException:
+            conn.execute('ROLLBACK;')
+            raise
+        timestamp(f'Indexed tags of {n} logs.')
+    finally:
+        conn.close()
+
+
+def ensure_tag_index(database='../data/.database.db'):
+    '''
+    Make sure the tag index exists and is up to date with LOGS. Returns False if it is not available (e.g. the
+    database is read-only, or not there at all).
+    '''
+    database = os.path.expanduser(database)
+    try:
+        conn = connect(database)
+        try:
+            exists = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='LOG_TAGS_DIRTY';").fetchone()
+            schema = conn.execute("SELECT sql FROM sqlite_master WHERE type='table' AND name='LOG_TAGS';").fetchone()
+            if not exists or not schema or 'NOCASE' not in schema[0]:
+                conn.close()
+                conn = None
+                rebuild_tag_index(database)
+                return True
+
+            dirty = [ID for ID, in conn.execute('SELECT LOG_ID FROM LOG_TAGS_DIRTY;')]
+            if dirty:
+                # only write when something has changed, to leave the database's modification time alone
+                conn.execute('BEGIN;')
+                try:
+                    index_logs(conn.cursor(), dirty)
+                    conn.execute('COMMIT;')
+                except BaseException:
+                    conn.execute('ROLLBACK;')
+                    raise
+        finally:
+            if conn:
+                conn.close()
+    except sqlite3.Error as e:
+        warning(f'Tag index unavailable: {e}')
+        return False
+    return True
+
+
+def quote(s):
+    s = str(s).replace("'", "''")
+    return f"'{s}'"
+
+
+def ascii_lower(s):
+    # the case folding of SQLite's NOCASE collation and LIKE operator
+    return ''.join(c.lower() if 'A' <= c <= 'Z' else c for c in str(s))
+
+
+# A tag condition is written as the pattern match on TAGS, which works on any database, marked with the tags it is
+# for. Where the query is run (locally or by the procserver), the marked condition is swapped for a lookup in the tag
+# index if that database has one (see resolve_tag_conditions).
+TAG_CONDITION_RE = re.compile(r'/\*TAGS (any|all) (\[.*?\])\*/ .*? /\*END TAGS\*/')
+
+
+def get_indexed_condition(GROUPS, mode):
+    tags = ', '.join(quote(group) for group in GROUPS)
+    sub_query = f'SELECT LOG_ID FROM LOG_TAGS WHERE TAG IN ({tags})'
+    if mode == 'all':
+        sub_query += f' GROUP BY LOG_ID HAVING COUNT(DISTINCT TAG)={len({ascii_lower(group) for group in GROUPS})}'
+    return f'ID IN ({sub_query})'
+
+
+def get_pattern_condition(GROUPS, mode):
+    conditions = list()
+    for group in GROUPS:
+        conditions.append(f'(TAGS = {quote(group)} COLLATE NOCASE OR TAGS LIKE {quote(group + ";%")} OR '
+                          f'TAGS LIKE {quote("%;" + group)} OR TAGS LIKE {quote("%;" + group + ";%")})')
+    return '(' + (' OR ' if mode == 'any' else ' AND ').join(conditions) + ')'
+
+
+def get_tag_condition(GROUPS, mode='any'):
+    '''
+    Returns an SQL condition on LOGS selecting logs with any (MODE='any') or all (MODE='all') of the tags in GROUPS.
+    '''
+    if mode not in ['any', 'all']:
+        raise TypeError(f'Keyword mode must be either \'any\' or \'all\'. Got \'{mode}\'.')
+
+    groups = [str(group) for group in GROUPS]
+    # '/' is escaped so that the list can't end the comment
+    marker = json.dumps(groups).replace('/', '\\/')
+    return f'/*TAGS {mode} {marker}*/ {get_pattern_condition(groups, mode)} /*END TAGS*/'
+
+
+def resolve_tag_conditions(query, database):
+    '''Returns QUERY with its tag conditions made lookups in the tag index, if DATABASE has (or can be given) one.'''
+    if '/*TAGS ' not in query or not ensure_tag_index(database):
+        return query
+
+    def indexed(match):
+        return get_indexed_condition(json.loads(match.group(2)), match.group(1))
+    return TAG_CONDITION_RE.sub(indexed, query)
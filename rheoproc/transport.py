@@ -0,0 +1,71 @@
+# rheoproc.transport
+# Moves the large arrays of a processed log from a worker process to the parent through memory-mapped files, rather
+# than pickling them down the pool's pipe. The worker writes each array to a file in the cache directory and sends
+# back a lightweight handle; the parent maps the file (copy-on-write, no copy made) and removes it.
+
+import os
+import uuid
+import shutil
+
+import numpy as np
+
+from rheoproc.cache import CACHE_DIR
+
+
+TRANSPORT_DIR = f'{CACHE_DIR}/transport'
+
+# arrays smaller than this are cheaper to pickle
+MIN_TRANSPORT_BYTES = 64*1024
+
+
+class ArrayHandle:
+
+    def __init__(self, path):
+        self.path = path
+
+    def attach(self):
+        arr = np.load(self.path, mmap_mode='c')
+        os.remove(self.path)
+        return arr.view(np.ndarray)
+
+
+def get_transport_dir(pid):
+    return f'{TRANSPORT_DIR}/{pid}'
+
+
+def pack_log(log):
+    '''
+    Called in the worker: replace large arrays in LOG's data with handles to files holding their contents.
+    '''
+    data = getattr(log, 'data', None)
+    if not isinstance(data, dict):
+        return log
+
+    # files are grouped by the process which will receive them, so it can tidy up any left behind
+    transport_dir = get_transport_dir(os.getppid())
+    os.makedirs(transport_dir, exist_ok=True)
+    for name, value in data.items():
+        if isinstance(value, np.ndarray) and value.dtype != object and value.nbytes >= MIN_TRANSPORT_BYTES:
+            path = f'{transport_dir}/{uuid.uuid4().hex}.npy'
+            np.save(path, value, allow_pickle=False)
+            data[name] = ArrayHandle(path)
+    return log
+
+
+def unpack_log(log):
+    '''
+    Called in the parent: replace handles in LOG's data with the arrays they refer to.
+    '''
+    data = getattr(log, 'data', None)
+    if not isinstance(data, dict):
+        return log
+
+    for name, value in data.items():
+        if isinstance(value, ArrayHandle):
+            data[name] = value.attach()
+    return log
+
+
+def clean_transport_dir():
+    '''Remove any files sent to this process which were never received (e.g. when a query is abandoned).'''
+    shutil.rmtree(get_transport_dir(os.getpid()), ignore_errors=True)
@@ -0,0 +1,76 @@
+# rheoproc.warm
+# Pre-warming of the cache: logs without a valid cached result for a processing configuration are processed in the
+# background, at low priority, so that later queries find them ready. Each log is cached as soon as it is processed, so
+# an interrupted run loses only the logs in progress, and running again picks up where it left off.
+
+import os
+import time
+import signal
+import threading
+
+from rheoproc.cache import Cache
+from rheoproc.sql import execute_sql
+from rheoproc.query import iter_rows, get_table, get_log_cache_key
+from rheoproc.pool import shutdown
+from rheoproc.error import timestamp, warning
+
+
+def set_niceness(nice):
+    '''Lower the priority of this process (and the workers it starts) to NICE, if it isn't already that low.'''
+    try:
+        current = os.nice(0)
+        if nice > current:
+            os.nice(nice - current)
+    except (AttributeError, OSError) as e:
+        warning(f'Could not lower process priority: {e}')
+
+
+def interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def get_uncached_rows(query, database, **kwargs):
+    '''Returns the rows of QUERY whose logs have no valid cached result for the processing configuration KWARGS.'''
+    cache = Cache()
+    table = get_table(query)
+    rows = list()
+    for row in execute_sql(query, database):
+        key = get_log_cache_key(row['ID'], table, dict(kwargs, database=database))
+        # checked directly rather than with is_cached, so warming doesn't count towards the cache's hit rate
+        if key not in cache.index or cache.index[key].is_invalid():
+            rows.append(row)
+    return rows
+
+
+def warm_cache(database='../data/.database.db', query='SELECT * FROM LOGS;', max_processes=4, nice=19, interval=None,
+               **kwargs):
+    '''
+    Process (in parallel over at most MAX_PROCESSES, at niceness NICE) the logs returned by QUERY which aren't cached
+    for the processing configuration KWARGS, most expensive first (see rheoproc.schedule). If INTERVAL is given, the
+    database is checked again every INTERVAL seconds for new or changed logs, until interrupted.
+    '''
+    database = os.path.expanduser(database)
+    table = get_table(query)
+    kwargs['ignore_exceptions'] = True
+    set_niceness(nice)
+    if threading.current_thread() is threading.main_thread():
+        # stopped as a service would be, it finishes the same way as when interrupted
+        signal.signal(signal.SIGTERM, interrupt)
+
+    try:
+        while True:
+            rows = get_uncached_rows(query, database, **kwargs)
+            if rows:
+                timestamp(f'Warming cache: {len(rows)} logs to process.')
+                n = sum(1 for __ in iter_rows(rows, table, database, max_processes=max_processes, **kwargs))
+                timestamp(f'Cached {n} logs' + (f' ({len(rows) - n} failed).' if n < len(rows) else '.'))
+            else:
+                timestamp('Cache is warm.')
+
+            if not interval:
+                break
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        warning('Interrupted: logs processed so far are cached, run again to resume.')
+    finally:
+        shutdown()
@@ -0,0 +1,124 @@
+# rheoproc.wire
+# Compact serialisation of logs for sending between processes or machines. The numeric arrays of a log (and long lists
+# of floats) are taken out into contiguous typed column buffers, described by a small JSON header; the rest of the
+# log (its class, attributes, and structure) is pickled with the columns replaced by references. Monotonic columns
+# (e.g. time, position) are delta-encoded, losslessly, as the differences between the bit patterns of successive values,
+# which compress far better than the values themselves. Columns can also be downcast to float32, losing precision.
+
+import io
+import json
+import pickle
+import struct
+import zlib
+
+import numpy as np
+
+
+MAGIC = b'RPW2'
+PREAMBLE = struct.Struct('!4sI')
+MIN_LIST_LENGTH = 16
+
+
+def is_column(obj):
+    if isinstance(obj, np.ndarray):
+        return obj.dtype.kind in 'biufc' and not obj.dtype.fields
+    if type(obj) is list and len(obj) >= MIN_LIST_LENGTH:
+        return all(type(v) is float for v in obj)
+    return False
+
+
+def get_delta_dtype(arr):
+    '''Returns the integer type to delta-encode ARR as, or None if it isn't a monotonic column worth encoding.'''
+    if arr.ndim != 1 or len(arr) < MIN_LIST_LENGTH or arr.dtype.kind not in 'iuf' or arr.dtype.itemsize not in (4, 8):
+        return None
+    if not (np.all(arr[1:] >= arr[:-1]) or np.all(arr[1:] <= arr[:-1])):
+        return None
+    return np.dtype(f'{arr.dtype.byteorder}i{arr.dtype.itemsize}')
+
+
+def delta_encode(arr, delta_dtype):
+    # integer arithmetic wraps around, so decoding gets back exactly the same bits
+    return np.diff(arr.view(delta_dtype), prepend=delta_dtype.type(0))
+
+
+def delta_decode(deltas, dtype):
+    return np.cumsum(deltas, dtype=deltas.dtype).view(dtype)
+
+
+class ColumnPickler(pickle.Pickler):
+
+    def __init__(self, f, float32=False):
+        super().__init__(f, protocol=4)
+        self.float32 = float32
+        self.columns = list()
+
+    def persistent_id(self, obj):
+        if not is_column(obj):
+            return None
+        kind = 'list' if isinstance(obj, list) else 'array'
+        arr = np.ascontiguousarray(obj, dtype=float if kind == 'list' else None)
+        wire_dtype = arr.dtype
+        if self.float32 and arr.dtype == np.float64:
+            wire_dtype = np.dtype(np.float32)
+        self.columns.append((kind, arr, wire_dtype))
+        return len(self.columns) - 1
+
+
+class ColumnUnpickler(pickle.Unpickler):
+
+    def __init__(self, f, columns):
+        super().__init__(f)
+        self.columns = columns
+
+    def persistent_load(self, pid):
+        return self.columns[pid]
+
+
+def dumps(obj, float32=False, level=1):
+    '''
+    Serialise OBJ (usually a log), compressed at zlib LEVEL. If FLOAT32, float64 arrays are sent as float32 (and
+    converted back on loading), losing precision.
+    '''
+    f = io.BytesIO()
+    pickler = ColumnPickler(f, float32=float32)
+    pickler.dump(obj)
+    skeleton = f.getvalue()
+
+    columns, buffers = list(), [skeleton]
+    for kind, arr, wire_dtype in pickler.columns:
+        values = arr.astype(wire_dtype, copy=False)
+        delta_dtype = get_delta_dtype(values)
+        if delta_dtype is not None:
+            values = delta_encode(values, delta_dtype)
+        buf = values.tobytes()
+        columns.append({'kind': kind, 'dtype': arr.dtype.str, 'wire_dtype': wire_dtype.str, 'shape': arr.shape,
+                        'delta': delta_dtype.str if delta_dtype is not None else None, 'nbytes': len(buf)})
+        buffers.append(buf)
+
+    header = json.dumps({'skeleton': len(skeleton), 'columns': columns}).encode()
+    return PREAMBLE.pack(MAGIC, len(header)) + header + zlib.compress(b''.join(buffers), level)
+
+
+def loads(data):
+    '''Returns the object serialised (by dumps) in DATA.'''
+    magic, header_size = PREAMBLE.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not a rheoproc wire-format object.')
+    header = json.loads(bytes(data[PREAMBLE.size:PREAMBLE.size + header_size]).decode())
+    body = memoryview(zlib.decompress(data[PREAMBLE.size + header_size:]))
+
+    skeleton = body[:header['skeleton']]
+    pos = header['skeleton']
+    columns = list()
+    for col in header['columns']:
+        buf = body[pos:pos + col['nbytes']]
+        pos += col['nbytes']
+        wire_dtype = np.dtype(col['wire_dtype'])
+        if col['delta']:
+            values = delta_decode(np.frombuffer(buf, dtype=col['delta']), wire_dtype)
+        else:
+            values = np.frombuffer(buf, dtype=wire_dtype)
+        arr = values.astype(col['dtype']).reshape(col['shape'])
+        columns.append(arr.tolist() if col['kind'] == 'list' else arr)
+
+    return ColumnUnpickler(io.BytesIO(skeleton), columns).load()
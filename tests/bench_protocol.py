@@ -0,0 +1,47 @@
+# Benchmark of the procserver protocol: a client receives framed payloads from a server on loopback, and the
+# throughput is reported in MB/s. Run as 'python tests/bench_protocol.py [<PAYLOAD-MB> [<N-FRAMES>]]'.
+
+import sys
+import socket
+import threading
+import time
+
+from rheoproc.protocol import Connection
+
+
+def serve(listener, payload, n_frames):
+    sock, __ = listener.accept()
+    with sock:
+        conn = Connection(sock)
+        conn.recv_message()
+        for __ in range(n_frames):
+            conn.send_frame('result', payload)
+        conn.close()
+
+
+def bench(payload_mb=64, n_frames=4):
+    payload = bytes(int(payload_mb*1024*1024))
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as listener:
+        listener.bind(('127.0.0.1', 0))
+        listener.listen()
+        server_thread = threading.Thread(target=serve, args=(listener, payload, n_frames), daemon=True)
+        server_thread.start()
+
+        with socket.create_connection(listener.getsockname()) as s:
+            conn = Connection(s)
+            before = time.time()
+            conn.send_message('request', 'bench')
+            total = 0
+            for __ in range(n_frames):
+                m_type, codec, length = conn.recv_header()
+                total += len(conn.recv_payload(length))
+            dt = time.time() - before
+            conn.close()
+        server_thread.join()
+
+    print(f'{total/1024/1024:.0f} MB in {dt:.2f} s: {total/1024/1024/dt:.1f} MB/s')
+
+
+if __name__ == '__main__':
+    bench(*[float(a) for a in sys.argv[1:2]], *[int(a) for a in sys.argv[2:3]])
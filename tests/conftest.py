@@ -0,0 +1,3 @@
+# test_accelproc.py and bench_protocol.py are scripts, run by hand ('python tests/<script>.py'): the former needs the
+# rig's database, so isn't collected with the unit tests.
+collect_ignore = ['test_accelproc.py']
@@ -0,0 +1,83 @@
+import os
+import sys
+import functools
+import subprocess
+
+import numpy as np
+
+from rheoproc.cache import hash_arguments
+
+
+def key(*args, **kwargs):
+    return hash_arguments(args, kwargs)
+
+
+def make_adder(n):
+    def add(x):
+        return x + n
+    return add
+
+
+def scale(x, factor=2):
+    return x*factor
+
+
+class Scaler:
+
+    def __init__(self, factor):
+        self.factor = factor
+
+    def apply(self, x):
+        return x*self.factor
+
+
+def test_arrays_by_contents():
+    assert key(np.arange(5)) == key(np.arange(5))
+    assert key(np.arange(5)) != key(np.arange(5.0))
+    assert key(np.arange(6).reshape(2, 3)) != key(np.arange(6).reshape(3, 2))
+    assert key(np.arange(5)) != key(list(range(5)))
+
+
+def test_functions_by_what_they_do():
+    assert key(lambda x: x + 1) == key(lambda x: x + 1)
+    assert key(lambda x: x + 1) != key(lambda x: x + 2)
+    assert key(make_adder(1)) == key(make_adder(1))
+    assert key(make_adder(1)) != key(make_adder(2))
+    assert key(scale) != key(functools.partial(scale, factor=2))
+    assert key(functools.partial(scale, factor=2)) != key(functools.partial(scale, factor=3))
+    assert key(functools.partial(scale, 1)) != key(functools.partial(scale, 2))
+
+
+def test_bound_methods_by_instance():
+    assert key(Scaler(2).apply) == key(Scaler(2).apply)
+    assert key(Scaler(2).apply) != key(Scaler(3).apply)
+    assert key(Scaler.apply) != key(Scaler(2).apply)
+
+
+def test_classes_and_builtins_by_name():
+    assert key(Scaler) == key(Scaler)
+    assert key(len) != key(max)
+    assert key(np.mean) == key(np.mean)
+
+
+def test_cycles():
+    a = [1]
+    a.append(a)
+    assert key(a) == key(a)
+
+    def recurse(n):
+        return recurse(n - 1) if n else 0
+    assert key(recurse) == key(recurse)
+
+
+def test_sets_are_stable_between_sessions():
+    code = ('from rheoproc.cache import hash_arguments; '
+            'print("KEY", hash_arguments(({"a", "bb", "ccc", ("d", 1)},), {}))')
+    keys = set()
+    for seed in ['1', '2', '3']:
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        output = subprocess.check_output([sys.executable, '-c', code], env=env, text=True)
+        # rheoproc prints timestamped messages of its own
+        keys.update(line.split()[1] for line in output.splitlines() if line.startswith('KEY '))
+    assert len(keys) == 1
+    assert keys == {key({'ccc', ('d', 1), 'bb', 'a'})}
@@ -0,0 +1,56 @@
+import json
+import sqlite3
+
+from rheoproc.cache import CacheIndex, CachedObjectData
+
+
+def write_json_index(directory, data):
+    with open(directory / 'index.json', 'w') as f:
+        json.dump(data, f)
+
+
+def test_json_index_is_migrated(tmp_path):
+    row_dependency = {'database': '/data/.database.db', 'query': 'SELECT * FROM LOGS WHERE ID=1;', 'hash': 'abc'}
+    write_json_index(tmp_path, {
+        'one': {'path': '/cache/one.pickle', 'expires': None, 'depends_on': ['/data/one.tar', row_dependency]},
+        'two': {'path': '/cache/two.pickle', 'expires': 12.5},
+    })
+    index = CacheIndex(str(tmp_path / 'index.db'))
+
+    assert not (tmp_path / 'index.json').exists()
+    assert len(index) == 2
+    one = index['one']
+    assert one.path == '/cache/one.pickle' and one.expires is None
+    assert one.depends_on == ['/data/one.tar', row_dependency]
+    two = index['two']
+    assert two.expires == 12.5 and two.depends_on is None
+
+
+def test_migration_keeps_newer_entries(tmp_path):
+    index = CacheIndex(str(tmp_path / 'index.db'))
+    index['one'] = CachedObjectData(path='/cache/new.pickle').as_dict()
+    write_json_index(tmp_path, {'one': {'path': '/cache/old.pickle'}, 'two': {'path': '/cache/two.pickle'}})
+
+    index = CacheIndex(str(tmp_path / 'index.db'))
+    assert index['one'].path == '/cache/new.pickle'
+    assert index['two'].path == '/cache/two.pickle'
+
+
+def test_unreadable_json_index_is_dropped(tmp_path):
+    (tmp_path / 'index.json').write_text('{"one": {"pa')
+    index = CacheIndex(str(tmp_path / 'index.db'))
+    assert len(index) == 0
+    assert not (tmp_path / 'index.json').exists()
+
+
+def test_older_index_database_gains_columns(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'index.db')
+    with conn:
+        conn.execute('CREATE TABLE OBJECTS (KEY TEXT PRIMARY KEY, PATH TEXT NOT NULL, EXPIRES REAL, DEPENDS_ON TEXT);')
+        conn.execute("INSERT INTO OBJECTS (KEY, PATH) VALUES ('one', '/cache/one.pickle');")
+    conn.close()
+
+    index = CacheIndex(str(tmp_path / 'index.db'))
+    assert index['one'].path == '/cache/one.pickle'
+    assert [key for key, __, __ in index.least_recently_used()] == ['one']
+    assert index.total_size() == 0
@@ -0,0 +1,28 @@
+import pytest
+
+from rheoproc.rheometerlog import resolve_fields, FIELD_DEPENDENCIES
+from rheoproc.exception import FieldError
+
+
+def test_everything_without_fields():
+    assert resolve_fields() == set(FIELD_DEPENDENCIES)
+
+
+def test_dependencies_are_followed():
+    assert resolve_fields(['temperature']) == {'time', 'raw_time', 'temperature'}
+    assert resolve_fields(['strainrate']) == {'time', 'raw_time', 'strainrate', 'speed', 'encoders'}
+    assert resolve_fields(['viscosity']) == {'time', 'raw_time', 'viscosity', 'stress', 'load_torque', 'loadcell',
+                                             'position', 'speed', 'encoders', 'strainrate'}
+    assert 'adc' not in resolve_fields(['viscosity'])
+
+
+def test_statistics_need_their_quantity():
+    assert resolve_fields(['viscosity_av', 'strainrate_std']) == resolve_fields(['viscosity', 'strainrate'])
+    assert resolve_fields(['expected_viscosity_av']) == {'time', 'raw_time', 'expected_viscosity', 'temperature'}
+
+
+def test_unknown_field():
+    with pytest.raises(FieldError):
+        resolve_fields(['viscosity', 'nope'])
+    with pytest.raises(FieldError):
+        resolve_fields(['viscosity_median'])
@@ -0,0 +1,49 @@
+from rheoproc.cache import MemoryTier
+
+
+def test_objects_are_kept_by_stamp():
+    memory = MemoryTier(100)
+    obj = {'a': 1}
+    memory.put('one', obj, 10, (1, 100))
+    assert memory.get('one', (1, 100)) is obj
+    # rewritten on disk since
+    assert memory.get('one', (2, 200)) is None
+    assert memory.get('two', (1, 100)) is None
+    assert (memory.hits, memory.misses) == (1, 2)
+
+
+def test_least_recently_used_are_dropped():
+    memory = MemoryTier(30)
+    for key in ['one', 'two', 'three']:
+        memory.put(key, key, 10, 0)
+    memory.get('one', 0)
+    memory.put('four', 'four', 10, 0)
+    assert memory.get('two', 0) is None
+    assert [memory.get(key, 0) for key in ['one', 'three', 'four']] == ['one', 'three', 'four']
+    assert memory.size == 30 and len(memory) == 3
+
+
+def test_replacing_an_object_frees_its_size():
+    memory = MemoryTier(30)
+    memory.put('one', 'old', 20, 0)
+    memory.put('one', 'new', 5, 1)
+    assert memory.size == 5 and memory.get('one', 1) == 'new'
+
+
+def test_objects_larger_than_the_budget_are_not_kept():
+    memory = MemoryTier(30)
+    memory.put('one', 'one', 10, 0)
+    memory.put('big', 'big', 40, 0)
+    assert memory.get('big', 0) is None
+    assert memory.get('one', 0) == 'one'
+
+
+def test_discard_and_clear():
+    memory = MemoryTier(30)
+    memory.put('one', 'one', 10, 0)
+    memory.put('two', 'two', 10, 0)
+    memory.discard('one')
+    memory.discard('missing')
+    assert memory.get('one', 0) is None and memory.size == 10
+    memory.clear()
+    assert len(memory) == 0 and memory.size == 0
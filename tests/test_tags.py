@@ -0,0 +1,85 @@
+import sqlite3
+
+from rheoproc.tags import ensure_tag_index, get_tag_condition, resolve_tag_conditions, get_pattern_condition
+
+
+TAGS = {1: 'A', 2: 'B;A', 3: 'a;C', 4: 'C', 5: None, 6: 'BB;C'}
+
+
+def make_database(path):
+    conn = sqlite3.connect(path)
+    with conn:
+        conn.execute('CREATE TABLE LOGS (ID INTEGER PRIMARY KEY, TAGS TEXT);')
+        conn.executemany('INSERT INTO LOGS (ID, TAGS) VALUES (?, ?);', TAGS.items())
+    conn.close()
+    return str(path)
+
+
+def select(database, condition):
+    conn = sqlite3.connect(database)
+    try:
+        return sorted(ID for ID, in conn.execute(f'SELECT ID FROM LOGS WHERE {condition};'))
+    finally:
+        conn.close()
+
+
+def tables(database):
+    conn = sqlite3.connect(database)
+    try:
+        return {name for name, in conn.execute("SELECT name FROM sqlite_master WHERE type='table';")}
+    finally:
+        conn.close()
+
+
+def test_indexed_and_pattern_conditions_agree(tmp_path):
+    database = make_database(tmp_path / 'db.db')
+    cases = [(['A'], 'any'), (['a'], 'any'), (['B', 'C'], 'any'), (['A', 'b'], 'all'), (['C', 'c'], 'all'),
+             (['B'], 'any'), (['nope'], 'any')]
+    for groups, mode in cases:
+        condition = get_tag_condition(groups, mode=mode)
+        # unresolved, the condition is a plain pattern match which any database can run
+        unresolved = select(database, condition)
+        assert unresolved == select(database, get_pattern_condition(groups, mode))
+        resolved = resolve_tag_conditions(condition, database)
+        assert 'LOG_TAGS' in resolved
+        assert select(database, resolved) == unresolved, (groups, mode)
+
+    assert select(database, resolve_tag_conditions(get_tag_condition(['a']), database)) == [1, 2, 3]
+    assert select(database, resolve_tag_conditions(get_tag_condition(['A', 'c'], mode='all'), database)) == [3]
+
+
+def test_index_follows_changes_to_logs(tmp_path):
+    database = make_database(tmp_path / 'db.db')
+    assert ensure_tag_index(database)
+    conn = sqlite3.connect(database)
+    with conn:
+        conn.execute("UPDATE LOGS SET TAGS='D' WHERE ID=1;")
+        conn.execute("INSERT INTO LOGS (ID, TAGS) VALUES (7, 'A;D');")
+        conn.execute('DELETE FROM LOGS WHERE ID=2;')
+    conn.close()
+    condition = resolve_tag_conditions(get_tag_condition(['A', 'D']), database)
+    assert select(database, condition) == [1, 3, 7]
+
+
+def test_tags_which_look_like_sql(tmp_path):
+    database = make_database(tmp_path / 'db.db')
+    for groups in [["it's"], ['*/'], ['a]*/b']]:
+        condition = get_tag_condition(groups)
+        assert select(database, resolve_tag_conditions(condition, database)) == []
+
+
+def test_missing_database_is_not_created(tmp_path):
+    database = str(tmp_path / 'missing.db')
+    condition = get_tag_condition(['A'])
+    assert not ensure_tag_index(database)
+    assert resolve_tag_conditions(f'SELECT * FROM LOGS WHERE {condition};', database) == \
+        f'SELECT * FROM LOGS WHERE {condition};'
+    assert not (tmp_path / 'missing.db').exists()
+
+
+def test_failed_index_build_leaves_nothing_behind(tmp_path):
+    # no LOGS table: the triggers can't be made
+    database = str(tmp_path / 'empty.db')
+    sqlite3.connect(database).close()
+    assert not ensure_tag_index(database)
+    assert tables(database) == set()
@@ -0,0 +1,74 @@
+import json
+import pickle
+import zlib
+
+import numpy as np
+import pytest
+
+from rheoproc import wire
+
+
+class Log:
+
+    def __init__(self, n=5000):
+        rng = np.random.default_rng(0)
+        self.ID = 7
+        self.time = np.arange(n)*0.001 + 12.5
+        self.position = np.cumsum(rng.integers(0, 5, n)).astype(np.int64)
+        self.speed = rng.normal(size=n)
+        self.falling = np.linspace(3.0, -3.0, n, dtype=np.float32)
+        self.image = rng.random((20, 30))
+        self.impedance = rng.normal(size=n) + 1j
+        self.loadcell = [float(v) for v in rng.normal(size=100)]
+        self.short = [1.5, 2.5]
+        self.gaps = np.array([0.0, np.nan, 1.0]*10)
+        self.data = {'viscosity_av': 1.25, 'tags': ['A', 'B']}
+
+
+def get_header(data):
+    __, size = wire.PREAMBLE.unpack_from(data)
+    return json.loads(data[wire.PREAMBLE.size:wire.PREAMBLE.size + size].decode())
+
+
+def assert_same(a, b):
+    assert type(a) is type(b)
+    for name, value in vars(a).items():
+        other = getattr(b, name)
+        if isinstance(value, np.ndarray):
+            assert value.dtype == other.dtype and value.shape == other.shape, name
+            assert value.tobytes() == other.tobytes(), name
+        else:
+            assert type(value) is type(other) and value == other, name
+
+
+def test_round_trip_is_lossless():
+    log = Log()
+    assert_same(log, wire.loads(wire.dumps(log)))
+    assert_same(log, wire.loads(wire.dumps(log, level=6)))
+
+
+def test_only_monotonic_columns_are_delta_encoded():
+    header = get_header(wire.dumps(Log()))
+    deltas = [bool(col['delta']) for col in header['columns']]
+    # time, position, speed, falling, image, impedance, loadcell, gaps
+    assert deltas == [True, True, False, True, False, False, False, False]
+
+
+def test_smaller_than_compressed_pickle():
+    log = Log()
+    assert len(wire.dumps(log)) < len(zlib.compress(pickle.dumps(log, protocol=4), 1))
+
+
+def test_float32():
+    log = Log()
+    back = wire.loads(wire.dumps(log, float32=True))
+    assert back.time.dtype == np.float64
+    assert np.allclose(back.time, log.time, rtol=1e-6)
+    assert np.allclose(back.speed, log.speed, rtol=1e-6)
+    assert back.position.tobytes() == log.position.tobytes()
+    assert type(back.loadcell) is list and np.allclose(back.loadcell, log.loadcell, rtol=1e-6)
+
+
+def test_not_wire_format():
+    with pytest.raises(ValueError):
+        wire.loads(wire.PREAMBLE.pack(b'NOPE', 0))